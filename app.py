@@ -1,9 +1,21 @@
-import os, io, re, zipfile, shutil, tempfile, traceback
+import os, time, logging, tempfile
 from datetime import datetime
-from PIL import Image, ImageDraw, ImageFont
-import numpy as np
-import cv2
 import streamlit as st
+from lfjc.cache import ImageCache
+from lfjc.core import Settings, MAX_WORKERS, plan_pdf, natural_sort_key, sort_files, sanitize_filename, find_font_path
+from lfjc.fonts import load_pdf_font
+from lfjc.governor import Governor
+from lfjc.jobs import JobQueue, QUEUED, RUNNING, FAILED
+from lfjc.store import UploadStore
+from lfjc.preview import render_preview
+
+# Export timings are written as JSON log lines by lfjc.metrics
+lfjc_logger = logging.getLogger("lfjc")
+if not lfjc_logger.handlers:
+    log_handler = logging.StreamHandler()
+    log_handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s %(message)s"))
+    lfjc_logger.addHandler(log_handler)
+    lfjc_logger.setLevel(os.environ.get("LFJC_LOG_LEVEL", "INFO"))
 
 # ------------------- PAGE CONFIG -------------------
 st.set_page_config(
@@ -134,6 +146,12 @@ st.markdown("""
 # ------------------- SESSION STATE -------------------
 if 'uploaded_files' not in st.session_state:
     st.session_state.uploaded_files = []
+if 'uploaded_hashes' not in st.session_state:
+    st.session_state.uploaded_hashes = set()
+if 'uploader_generation' not in st.session_state:
+    st.session_state.uploader_generation = 0
+if 'store_touched' not in st.session_state:
+    st.session_state.store_touched = 0.0
 if 'processed_files' not in st.session_state:
     st.session_state.processed_files = []
 if 'sidebar_visible' not in st.session_state:
@@ -146,6 +164,16 @@ if 'download_filename' not in st.session_state:
     st.session_state.download_filename = ""
 if 'download_type' not in st.session_state:
     st.session_state.download_type = ""
+if 'export_jobs' not in st.session_state:
+    st.session_state.export_jobs = []
+if 'delivered_jobs' not in st.session_state:
+    st.session_state.delivered_jobs = set()
+if 'offered_download' not in st.session_state:
+    st.session_state.offered_download = None
+if 'prefetched' not in st.session_state:
+    st.session_state.prefetched = set()
+if 'settings' not in st.session_state:
+    st.session_state.settings = Settings()
 
 # ------------------- SIDEBAR TOGGLE BUTTON -------------------
 if not st.session_state.sidebar_visible:
@@ -174,6 +202,9 @@ st.markdown("""
 """, unsafe_allow_html=True)
 
 # ------------------- SIDEBAR -------------------
+ENHANCEMENT_PROFILE_OPTIONS = {"Quality": "quality", "Fast": "fast", "None": "none"}
+PACKING_OPTIONS = {"Fill pages": "greedy", "Keep questions whole": "fit"}
+
 if st.session_state.sidebar_visible:
     with st.sidebar:
         col1, col2 = st.columns([4, 1])
@@ -251,6 +282,82 @@ if st.session_state.sidebar_visible:
                                            help="Images to skip from numbering sequence",
                                            key="skip_numbering")
         
+        st.markdown('<div class="section-header">🧪 IMAGE ENHANCEMENT</div>', unsafe_allow_html=True)
+        enhancement_profile = st.selectbox(
+            "Enhancement Profile",
+            list(ENHANCEMENT_PROFILE_OPTIONS),
+            index=0,
+            help="Quality: strongest noise removal, slowest. Fast: edge-preserving filter, "
+                 "about 50x faster with near-identical output. None: no noise removal.",
+            key="enhancement_profile"
+        )
+        denoise_at_output = st.checkbox(
+            "Denoise at page resolution",
+            value=False,
+            help="Remove noise on a copy scaled to the PDF column width. Faster for large photos.",
+            key="denoise_at_output"
+        )
+        scale_first = st.checkbox(
+            "Scale before enhancing",
+            value=False,
+            help="Shrink each photo to its printed size before enhancement. Much faster and lighter "
+                 "on memory for large camera images; applies to the PDF only.",
+            key="scale_first"
+        )
+        detect_document = st.checkbox(
+            "Crop to the answer sheet",
+            value=False,
+            help="Find the sheet in each photo, cut away the desk and margins around it and "
+                 "straighten it if it was photographed at an angle.",
+            key="detect_document"
+        )
+        trim_bottom = st.checkbox(
+            "Trim blank space at the bottom",
+            value=False,
+            help="Drop the empty part of a sheet below its last written line, so half-filled "
+                 "sheets take less room on the page.",
+            key="trim_bottom"
+        )
+        
+        st.markdown('<div class="section-header">📄 PDF OUTPUT</div>', unsafe_allow_html=True)
+        pdf_output = st.radio(
+            "Page Encoding",
+            ["Standard", "Compact B&W"],
+            horizontal=True,
+            index=0,
+            help="Compact B&W stores the scanned sheets as 1-bit images. "
+                 "Files are many times smaller and faster to download.",
+            key="pdf_output"
+        )
+        page_packing = st.radio(
+            "Page Packing",
+            list(PACKING_OPTIONS),
+            horizontal=True,
+            index=0,
+            help="Fill pages splits any question that reaches the bottom of a page. Keep questions whole "
+                 "moves short questions to the next page, splits long ones between lines of writing and "
+                 "uses as few pages as it can.",
+            key="page_packing"
+        )
+        
+        settings = Settings(
+            exam_type=exam_type,
+            exam_date=exam_date,
+            alignment=alignment,
+            strips=[(strip_q1, ratio_val1), (strip_q2, ratio_val2), (strip_q3, ratio_val3)],
+            multi_numbering=multi_numbering_input,
+            skip_numbering=skip_numbering_input,
+            enhancement_profile=ENHANCEMENT_PROFILE_OPTIONS[enhancement_profile],
+            denoise_at_output=denoise_at_output,
+            scale_first=scale_first,
+            detect_document=detect_document,
+            trim_bottom=trim_bottom,
+            compact=pdf_output == "Compact B&W",
+            packing=PACKING_OPTIONS[page_packing]
+        )
+        # Kept for while the panel is hidden, so exports and prefetching keep using these
+        st.session_state.settings = settings
+        
         st.markdown("---")
         
         with st.expander("📖 Quick Help"):
@@ -267,6 +374,7 @@ if st.session_state.sidebar_visible:
         st.markdown("*Settings panel can be reopened from the ☰ button*")
 
 else:
+    settings = st.session_state.settings
     st.markdown("""
     <div style='text-align: center; padding: 2rem;'>
         <h3>Settings Panel Hidden</h3>
@@ -278,6 +386,27 @@ else:
         st.session_state.sidebar_visible = True
         st.rerun()
 
+# ------------------- UPLOAD STORE -------------------
+UPLOAD_DIR = os.environ.get("LFJC_UPLOAD_DIR", os.path.join(tempfile.gettempdir(), "lfjc_uploads"))
+UPLOAD_IDLE_HOURS = float(os.environ.get("LFJC_UPLOAD_IDLE_HOURS", 6))
+UPLOAD_TOUCH_SECONDS = 300
+
+@st.cache_resource
+def get_upload_store():
+    """Uploaded images on disk; the session only keeps each image's hash, name and size"""
+    return UploadStore(UPLOAD_DIR, UPLOAD_IDLE_HOURS * 3600)
+
+# Keep this session's images alive and sweep out those of sessions that went idle
+if time.time() - st.session_state.store_touched > UPLOAD_TOUCH_SECONDS:
+    st.session_state.store_touched = time.time()
+    upload_store = get_upload_store()
+    present = upload_store.touch(st.session_state.uploaded_files)
+    if len(present) < len(st.session_state.uploaded_files):
+        st.warning(f"⚠️ {len(st.session_state.uploaded_files) - len(present)} images expired after a long idle period; please add them again")
+        st.session_state.uploaded_files = present
+        st.session_state.uploaded_hashes = {f['hash'] for f in present}
+    upload_store.collect()
+
 # ------------------- MAIN AREA -------------------
 st.markdown("### 📁 UPLOAD ANSWER SHEETS")
 
@@ -286,7 +415,8 @@ uploaded_files = st.file_uploader(
     type=['png', 'jpg', 'jpeg'],
     accept_multiple_files=True,
     help="Select multiple images. Each batch processes up to 10 images.",
-    key="file_uploader"
+    # A new key after each add clears the widget, so Streamlit drops its in-memory copies
+    key=f"file_uploader_{st.session_state.uploader_generation}"
 )
 
 if uploaded_files:
@@ -294,19 +424,28 @@ if uploaded_files:
     
     with col1:
         if st.button("📥 **ADD TO PROCESSING QUEUE**", use_container_width=True, type="primary"):
+            upload_store = get_upload_store()
+            added = 0
             for uploaded_file in uploaded_files:
-                if not any(f['name'] == uploaded_file.name for f in st.session_state.uploaded_files):
-                    st.session_state.uploaded_files.append({
-                        'name': uploaded_file.name,
-                        'bytes': uploaded_file.read()
-                    })
-            st.success(f"✅ Successfully added {len(uploaded_files)} new images to processing queue")
+                try:
+                    entry = upload_store.add(uploaded_file.name, uploaded_file.getvalue())
+                except Exception as e:
+                    st.error(f"Error processing {uploaded_file.name}: {str(e)}")
+                    continue
+                if entry['hash'] not in st.session_state.uploaded_hashes:
+                    st.session_state.uploaded_hashes.add(entry['hash'])
+                    st.session_state.uploaded_files.append(entry)
+                    added += 1
+            st.session_state.uploader_generation += 1
+            st.success(f"✅ Successfully added {added} new images to processing queue")
             st.rerun()
     
     with col2:
         if st.button("🗑️ **CLEAR PROCESSING QUEUE**", use_container_width=True, type="secondary"):
             st.session_state.uploaded_files = []
+            st.session_state.uploaded_hashes = set()
             st.session_state.processed_files = []
+            st.session_state.prefetched = set()
             st.success("✅ Processing queue cleared successfully")
             st.rerun()
 
@@ -316,98 +455,15 @@ if st.session_state.uploaded_files:
     for idx, file_info in enumerate(st.session_state.uploaded_files):
         st.markdown(f'<div class="selected-file">📄 {file_info["name"]}</div>', unsafe_allow_html=True)
 
-# ------------------- HELPER FUNCTIONS -------------------
-def enhance_image_opencv(pil_img):
-    try:
-        img_cv = cv2.cvtColor(np.array(pil_img), cv2.COLOR_RGB2BGR)
-        gray = cv2.cvtColor(img_cv, cv2.COLOR_BGR2GRAY)
-        denoised = cv2.fastNlMeansDenoising(gray, h=10)
-        thresh = cv2.adaptiveThreshold(denoised, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, 29, 17)
-        kernel = np.array([[0, -1, 0], [-1, 5, -1], [0, -1, 0]])
-        sharpened = cv2.filter2D(thresh, -1, kernel)
-        return Image.fromarray(cv2.cvtColor(sharpened, cv2.COLOR_GRAY2RGB))
-    except:
-        return pil_img
-
-def natural_sort_key(s):
-    return [int(text) if text.isdigit() else text.lower() for text in re.split(r'(\d+)', s)]
-
-def parse_qnos(qnos_str):
-    q_list = []
-    if not qnos_str:
-        return q_list
-    for part in qnos_str.split(','):
-        part = part.strip()
-        if '-' in part:
-            start, end = map(int, part.split('-'))
-            q_list.extend(range(start, end + 1))
-        elif part:
-            q_list.append(int(part))
-    return q_list
-
-def parse_multi_numbering(input_str):
-    numbering_map = {}
-    if not input_str:
-        return numbering_map
-    for part in input_str.split(','):
-        part = part.strip()
-        if ':' in part:
-            img_range, start_num = part.split(':')
-            try:
-                start_num = int(start_num)
-            except ValueError:
-                continue
-            if '-' in img_range:
-                start_idx, end_idx = map(int, img_range.split('-'))
-                for i, idx in enumerate(range(start_idx, end_idx + 1)):
-                    numbering_map[idx] = start_num + i
-            else:
-                idx = int(img_range)
-                numbering_map[idx] = start_num
-    return numbering_map
-
-def parse_skip_images(skip_str):
-    skip_list = []
-    if not skip_str:
-        return skip_list
-    for part in skip_str.split(','):
-        part = part.strip()
-        if '-' in part:
-            start, end = map(int, part.split('-'))
-            skip_list.extend(range(start, end + 1))
-        elif part:
-            skip_list.append(int(part))
-    return skip_list
-
-def sanitize_filename(name):
-    cleaned_name = re.sub(r'[^À-῿Ⰰ-퟿豈-﷏\w\s.-]', '_', name)
-    cleaned_name = re.sub(r'\s+', '_', cleaned_name)
-    cleaned_name = cleaned_name.strip('_')
-    if not cleaned_name:
-        return "untitled"
-    return cleaned_name
-
-def get_strip_mapping():
-    mapping = {}
-    if strip_q1:
-        for q in parse_qnos(strip_q1):
-            mapping[q] = ratio_val1
-    if strip_q2:
-        for q in parse_qnos(strip_q2):
-            mapping[q] = ratio_val2
-    if strip_q3:
-        for q in parse_qnos(strip_q3):
-            mapping[q] = ratio_val3
-    return mapping
-
-def load_font_with_size(size):
-    try:
-        return ImageFont.truetype("arial.ttf", size)
-    except:
-        try:
-            return ImageFont.truetype("/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf", size)
-        except:
-            return ImageFont.load_default()
+# ------------------- ENHANCEMENT CACHE -------------------
+CACHE_DIR = os.environ.get("LFJC_CACHE_DIR", os.path.join(tempfile.gettempdir(), "lfjc_cache"))
+CACHE_MEMORY_MB = int(os.environ.get("LFJC_CACHE_MEMORY_MB", 512))
+CACHE_DISK_MB = int(os.environ.get("LFJC_CACHE_DISK_MB", 2048))
+
+@st.cache_resource
+def get_image_cache():
+    """Enhanced-image cache shared by every rerun, session and export path"""
+    return ImageCache(CACHE_DIR, CACHE_MEMORY_MB * 1024 * 1024, CACHE_DISK_MB * 1024 * 1024)
 
 # ------------------- AUTO-DOWNLOAD FUNCTION -------------------
 def trigger_auto_download(file_data, filename, file_type):
@@ -417,308 +473,212 @@ def trigger_auto_download(file_data, filename, file_type):
     st.session_state.download_filename = filename
     st.session_state.download_type = file_type
 
-# ------------------- PDF GENERATION -------------------
-def create_pdf(files):
-    try:
-        A4_WIDTH, A4_HEIGHT = int(8.27 * 300), int(11.69 * 300)
-        TOP_MARGIN_FIRST_PAGE, TOP_MARGIN_SUBSEQUENT_PAGES = 125, 110
-        BOTTOM_MARGIN = 105
-        GAP_BETWEEN_IMAGES = 20
-        OVERLAP_PIXELS = 25
-        WATERMARK_TEXT = "LFJC"
-        WATERMARK_OPACITY = int(255 * 0.20)
-
-        pdf_pages = []
-        
-        header_font = load_font_with_size(60)
-        subheader_font = load_font_with_size(45)
-        question_font = load_font_with_size(40)
-        page_number_font = load_font_with_size(30)
-        watermark_font = load_font_with_size(800)
-
-        strip_mapping = get_strip_mapping()
-        numbering_map = parse_multi_numbering(multi_numbering_input)
-        skip_list = parse_skip_images(skip_numbering_input)
-
-        current_page = Image.new('RGB', (A4_WIDTH, A4_HEIGHT), (255, 255, 255))
-        y_offset = TOP_MARGIN_FIRST_PAGE
-
-        draw_header = ImageDraw.Draw(current_page)
-        college_name = "LITTLE FLOWER JUNIOR COLLEGE, UPPAL, HYD-39"
-        
-        try:
-            bbox = draw_header.textbbox((0, 0), college_name, font=header_font)
-            text_width = bbox[2] - bbox[0]
-            text_height = bbox[3] - bbox[1]
-            draw_header.text(((A4_WIDTH - text_width) // 2, y_offset), college_name, fill="black", font=header_font)
-            y_offset += text_height + 10
-        except:
-            draw_header.text((A4_WIDTH // 4, y_offset), college_name, fill="black", font=header_font)
-            y_offset += 80
-
-        combined_header = f"{exam_type}   {exam_date}"
-        try:
-            bbox = draw_header.textbbox((0, 0), combined_header, font=subheader_font)
-            text_width = bbox[2] - bbox[0]
-            text_height = bbox[3] - bbox[1]
-            draw_header.text(((A4_WIDTH - text_width) // 2, y_offset), combined_header, fill="black", font=subheader_font)
-            y_offset += text_height + 40
-        except:
-            draw_header.text((A4_WIDTH // 3, y_offset), combined_header, fill="black", font=subheader_font)
-            y_offset += 60
-
-        image_index = 1
-        question_number_counter = 0
-
-        files.sort(key=lambda x: natural_sort_key(x['name']))
-
-        for file_info in files:
-            question_number_to_display = None
-            if image_index in numbering_map:
-                question_number_to_display = numbering_map[image_index]
-            elif image_index not in skip_list:
-                question_number_counter += 1
-                question_number_to_display = question_number_counter
-            else:
-                image_index += 1
-                continue
-            
-            try:
-                img = Image.open(io.BytesIO(file_info['bytes'])).convert('RGB')
-                img = enhance_image_opencv(img)
-                
-                if alignment == "Center":
-                    scale = (A4_WIDTH * 0.9) / img.width
-                else:
-                    SIDE_MARGIN = 50
-                    scale = ((A4_WIDTH - SIDE_MARGIN) * 0.9) / img.width
-                
-                img_scaled = img.resize((int(img.width * scale), int(img.height * scale)), Image.Resampling.LANCZOS)
-                img_to_process = img_scaled
-                is_first_part = True
-
-                while img_to_process:
-                    remaining_space = A4_HEIGHT - y_offset - BOTTOM_MARGIN
-                    if img_to_process.height <= remaining_space:
-                        img_part = img_to_process
-                        img_to_process = None
-                    else:
-                        split_height = remaining_space + OVERLAP_PIXELS
-                        img_part = img_to_process.crop((0, 0, img_to_process.width, split_height))
-                        img_to_process = img_to_process.crop((0, split_height - OVERLAP_PIXELS, img_to_process.width, img_to_process.height))
-
-                    draw_img = ImageDraw.Draw(img_part)
-
-                    fraction = strip_mapping.get(question_number_to_display, None)
-                    if fraction is not None:
-                        strip_width = int(img_part.width * fraction)
-                        draw_img.rectangle([(0, 0), (strip_width, img_part.height)], fill=(255, 255, 255))
-
-                    if is_first_part and question_number_to_display is not None:
-                        try:
-                            bbox = draw_img.textbbox((0, 0), f"{question_number_to_display}.", font=question_font)
-                            text_width_q = bbox[2] - bbox[0]
-                            text_height_q = bbox[3] - bbox[1]
-                            text_x = (strip_width - text_width_q - 10) if fraction is not None else 10
-                            draw_img.text((text_x, 10), f"{question_number_to_display}.", font=question_font, fill="black")
-                        except:
-                            draw_img.text((10, 10), f"{question_number_to_display}.", font=question_font, fill="black")
-                        is_first_part = False
-
-                    if alignment == "Center":
-                        x_position = (A4_WIDTH - img_part.width) // 2
-                    elif alignment == "Left":
-                        x_position = 50
-                    else:
-                        x_position = A4_WIDTH - img_part.width - 50
-                    
-                    current_page.paste(img_part, (x_position, y_offset))
-                    y_offset += img_part.height + GAP_BETWEEN_IMAGES
-
-                    if img_to_process:
-                        pdf_pages.append(current_page)
-                        current_page = Image.new('RGB', (A4_WIDTH, A4_HEIGHT), (255, 255, 255))
-                        y_offset = TOP_MARGIN_SUBSEQUENT_PAGES
-
-                image_index += 1
-
-            except Exception as e:
-                st.error(f"Error processing {file_info['name']}: {e}")
-                continue
-
-        pdf_pages.append(current_page)
-
-        for i, page in enumerate(pdf_pages):
-            try:
-                draw_page = ImageDraw.Draw(page)
-                draw_page.text((A4_WIDTH//3, A4_HEIGHT//2), WATERMARK_TEXT, fill=(200, 200, 200, 100), font=watermark_font)
-            except:
-                pass
-
-            if i > 0:
-                try:
-                    draw_page_num = ImageDraw.Draw(page)
-                    page_number_text = str(i + 1)
-                    draw_page_num.text((A4_WIDTH//2, A4_HEIGHT - 50), page_number_text, fill="black", font=page_number_font)
-                except:
-                    pass
-
-        pdf_buffer = io.BytesIO()
-        pdf_pages[0].save(pdf_buffer, format='PDF', save_all=True, append_images=pdf_pages[1:], resolution=100.0)
-        pdf_buffer.seek(0)
-        
-        return pdf_buffer.getvalue()
-
-    except Exception as e:
-        st.error(f"PDF Creation Error: {str(e)}")
-        traceback.print_exc()
-        return None
-
-def create_zip(files):
-    try:
-        temp_dir = tempfile.mkdtemp()
-        processed_files = []
-        
-        strip_mapping = get_strip_mapping()
-        numbering_map = parse_multi_numbering(multi_numbering_input)
-        skip_list = parse_skip_images(skip_numbering_input)
-        
-        image_index = 1
-        question_number_counter = 0
-        
-        for file_info in files:
-            question_number_to_display = None
-            if image_index in numbering_map:
-                question_number_to_display = numbering_map[image_index]
-            elif image_index not in skip_list:
-                question_number_counter += 1
-                question_number_to_display = question_number_counter
-            
-            if question_number_to_display:
-                try:
-                    img = Image.open(io.BytesIO(file_info['bytes'])).convert('RGB')
-                    img = enhance_image_opencv(img)
-                    
-                    strip_fraction = strip_mapping.get(question_number_to_display)
-                    if strip_fraction is not None and strip_fraction > 0:
-                        original_width = img.width
-                        crop_width = int(original_width * (1 - strip_fraction))
-                        img = img.crop((original_width - crop_width, 0, original_width, img.height))
-                    
-                    filename = f"Q{question_number_to_display:03d}.png"
-                    filepath = os.path.join(temp_dir, filename)
-                    img.save(filepath, "PNG", quality=95)
-                    processed_files.append(filepath)
-                    
-                except Exception as e:
-                    st.error(f"Error processing {file_info['name']}: {e}")
-            
-            image_index += 1
-        
-        zip_buffer = io.BytesIO()
-        with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zipf:
-            for filepath in processed_files:
-                zipf.write(filepath, os.path.basename(filepath))
-        
-        zip_buffer.seek(0)
-        
-        shutil.rmtree(temp_dir, ignore_errors=True)
-        
-        return zip_buffer.getvalue(), len(processed_files)
-        
-    except Exception as e:
-        st.error(f"Archive Creation Error: {str(e)}")
-        traceback.print_exc()
-        return None, 0
+# ------------------- EXPORT JOBS -------------------
+JOB_DIR = os.environ.get("LFJC_JOB_DIR", os.path.join(tempfile.gettempdir(), "lfjc_jobs"))
+MAX_RUNNING_JOBS = int(os.environ.get("LFJC_MAX_JOBS", 2))
+JOB_KEEP_MINUTES = int(os.environ.get("LFJC_JOB_KEEP_MINUTES", 60))
+JOB_POLL_SECONDS = 1.0
+# Limits on image processing across every session: images processed at once, and the memory
+# they may take between them
+IMAGE_WORKERS = MAX_WORKERS
+IMAGE_MEMORY_MB = int(os.environ.get("LFJC_IMAGE_MEMORY_MB", 2048))
+
+@st.cache_resource
+def get_job_queue():
+    """Background export queue shared by every session on this server"""
+    return JobQueue(JOB_DIR, MAX_RUNNING_JOBS, JOB_KEEP_MINUTES * 60, get_image_cache(),
+                    Governor(IMAGE_WORKERS, IMAGE_MEMORY_MB * 1024 * 1024))
+
+def submit_export(kind, filename):
+    job_id = get_job_queue().submit(kind, st.session_state.uploaded_files, settings, filename)
+    st.session_state.export_jobs.append(job_id)
+
+def submit_both(pdf_filename, zip_filename):
+    job_ids = get_job_queue().submit_both(st.session_state.uploaded_files, settings, pdf_filename, zip_filename)
+    st.session_state.export_jobs.extend(job_ids)
+
+# Queued images are enhanced in the background straight away, and again whenever a setting that
+# changes the enhanced image does, so by export time only layout and encoding are left
+prefetch_settings = (settings.enhancement_profile, settings.denoise_at_output, settings.scale_first, settings.alignment,
+                     settings.detect_document, settings.trim_bottom)
+to_prefetch = [f for f in sort_files(st.session_state.uploaded_files)
+               if (f['hash'], prefetch_settings) not in st.session_state.prefetched]
+if to_prefetch:
+    get_job_queue().prefetch(to_prefetch, settings)
+    st.session_state.prefetched.update((f['hash'], prefetch_settings) for f in to_prefetch)
 
 # ------------------- GENERATE BUTTONS -------------------
 st.markdown("---")
 st.markdown("### 🚀 PROCESSING OPTIONS")
 
 if st.session_state.uploaded_files:
+    # Layout needs only the recorded image sizes and whatever sheet scans prefetching has cached, so
+    # the page count costs nothing on a rerun; until the scans are in it assumes whole images
+    if st.session_state.sidebar_visible:
+        try:
+            _, _, planned_pages = plan_pdf(st.session_state.uploaded_files, settings, load_pdf_font(find_font_path()),
+                                           on_error=st.error, cache=get_image_cache(), governor=get_job_queue().governor,
+                                           cached_only=True)
+            st.caption(f"📄 The PDF will have {len(planned_pages)} page{'s' if len(planned_pages) != 1 else ''}")
+        except Exception:
+            pass
+
+        # Thumbnails are cached, so the preview redraws in milliseconds as settings change
+        if st.toggle("👁️ Live page preview", key="live_preview",
+                     help="Check strips, numbering and page breaks before generating the full PDF"):
+            try:
+                preview_pages = render_preview(st.session_state.uploaded_files, settings, get_image_cache(), on_error=lambda message: None,
+                                               governor=get_job_queue().governor)
+                st.image(preview_pages, caption=[f"Page {n}" for n in range(1, len(preview_pages) + 1)], width=200)
+            except Exception as e:
+                st.warning(f"Preview unavailable: {str(e)}")
+    
     col1, col2 = st.columns(2)
     
     with col1:
         if st.button("📄 **GENERATE PDF DOCUMENT**", use_container_width=True, type="primary"):
-            if not exam_type or not exam_date:
+            if not settings.exam_type or not settings.exam_date:
                 st.error("❌ Please enter exam details in the settings panel!")
                 if not st.session_state.sidebar_visible:
                     st.info("📝 Click the ☰ button to open settings panel")
             else:
-                with st.spinner(f"🔨 Processing {len(st.session_state.uploaded_files)} images into PDF..."):
-                    pdf_data = create_pdf(st.session_state.uploaded_files)
-                    
-                    if pdf_data:
-                        filename = f"{sanitize_filename(exam_type)}_{sanitize_filename(exam_date)}_processed.pdf"
-                        trigger_auto_download(pdf_data, filename, "pdf")
-                        st.success("✅ PDF document created successfully!")
-                        st.info("📥 Download will start automatically...")
-                        
-                        # Create hidden download button for auto-download
-                        st.download_button(
-                            label=" ",
-                            data=pdf_data,
-                            file_name=filename,
-                            mime="application/pdf",
-                            key="auto_download_pdf",
-                            use_container_width=True
-                        )
-                        
-                        # Auto-click JavaScript
-                        st.markdown("""
-                        <script>
-                        setTimeout(function() {
-                            const buttons = document.querySelectorAll('[data-testid="stDownloadButton"] button');
-                            buttons.forEach(btn => {
-                                if(btn.textContent.includes('Download') || btn.textContent.trim() === '') {
-                                    btn.click();
-                                }
-                            });
-                        }, 500);
-                        </script>
-                        """, unsafe_allow_html=True)
-                    else:
-                        st.error("❌ Failed to create PDF document")
+                st.session_state.uploaded_files.sort(key=lambda x: natural_sort_key(x['name']))
+                filename = f"{sanitize_filename(settings.exam_type)}_{sanitize_filename(settings.exam_date)}_processed.pdf"
+                submit_export("pdf", filename)
     
     with col2:
         if st.button("🗃️ **EXPORT PROCESSED IMAGES**", use_container_width=True, type="secondary"):
-            with st.spinner("🔨 Creating archive of processed images..."):
-                zip_data, processed_count = create_zip(st.session_state.uploaded_files)
-                
-                if zip_data:
-                    filename = f"{sanitize_filename(exam_type)}_{sanitize_filename(exam_date)}_processed_images.zip"
-                    trigger_auto_download(zip_data, filename, "zip")
-                    st.success(f"✅ Archive created with {processed_count} processed images!")
-                    st.info("📥 Download will start automatically...")
-                    
-                    # Create hidden download button for auto-download
-                    st.download_button(
-                        label=" ",
-                        data=zip_data,
-                        file_name=filename,
-                        mime="application/zip",
-                        key="auto_download_zip",
-                        use_container_width=True
-                    )
-                    
-                    # Auto-click JavaScript
-                    st.markdown("""
-                    <script>
-                    setTimeout(function() {
-                        const buttons = document.querySelectorAll('[data-testid="stDownloadButton"] button');
-                        buttons.forEach(btn => {
-                            if(btn.textContent.includes('Download') || btn.textContent.trim() === '') {
-                                btn.click();
-                            }
-                        });
-                    }, 500);
-                    </script>
-                    """, unsafe_allow_html=True)
-                else:
-                    st.error("❌ Failed to create ZIP archive")
+            filename = f"{sanitize_filename(settings.exam_type)}_{sanitize_filename(settings.exam_date)}_processed_images.zip"
+            submit_export("zip", filename)
+
+    # Each image is enhanced once for both files, so this takes about as long as the slower export alone
+    if st.button("📦 **EXPORT BOTH (PDF + IMAGES)**", use_container_width=True, type="secondary"):
+        if not settings.exam_type or not settings.exam_date:
+            st.error("❌ Please enter exam details in the settings panel!")
+            if not st.session_state.sidebar_visible:
+                st.info("📝 Click the ☰ button to open settings panel")
+        else:
+            st.session_state.uploaded_files.sort(key=lambda x: natural_sort_key(x['name']))
+            base = f"{sanitize_filename(settings.exam_type)}_{sanitize_filename(settings.exam_date)}"
+            submit_both(f"{base}_processed.pdf", f"{base}_processed_images.zip")
 else:
     st.info("📤 Upload answer sheet images and add them to the processing queue to begin")
 
+# ------------------- EXPORT STATUS -------------------
+EXPORT_LABELS = {"pdf": "PDF document", "zip": "image archive"}
+EXPORT_MIME_TYPES = {"pdf": "application/pdf", "zip": "application/zip"}
+
+def show_performance(job):
+    totals = job.metrics.summary()
+    if not totals:
+        return
+    with st.expander("⏱️ Performance"):
+        st.caption(f"Finished in {job.finished - job.metrics.started:.1f} s. Stages run in parallel, "
+                   "so their times can add up to more than that.")
+        st.dataframe([{
+            "Stage": total["stage"],
+            "Runs": total["count"],
+            "Total (s)": round(total["seconds"], 2),
+            "Per run (ms)": round(1000 * total["seconds"] / total["count"], 1),
+            "Megapixels": round(total["megapixels"], 1),
+            "Max RSS (MB)": round(total["max_rss_mb"]) if total["max_rss_mb"] is not None else None,
+        } for total in totals], hide_index=True, use_container_width=True)
+        slowest = sorted(job.metrics.records, key=lambda record: record["seconds"], reverse=True)[:10]
+        st.markdown("**Slowest steps**")
+        st.dataframe([{
+            "Stage": record["stage"],
+            "Image / page": record["item"] or "",
+            "Time (ms)": round(1000 * record["seconds"], 1),
+            "Megapixels": round(record["pixels"] / 1e6, 2),
+            "RSS (MB)": round(record["rss_mb"]) if record["rss_mb"] is not None else None,
+        } for record in slowest], hide_index=True, use_container_width=True)
+
+def format_eta(seconds):
+    if seconds is None:
+        return ""
+    minutes = round(seconds / 60)
+    if minutes < 1:
+        return ", less than a minute left"
+    return ", about a minute left" if minutes == 1 else f", about {minutes} minutes left"
+
+def show_export_job(job):
+    label = EXPORT_LABELS[job.kind]
+    if job.state == QUEUED:
+        queue = get_job_queue()
+        st.progress(0.0, text=f"⏳ {label} queued, position {queue.position(job) + 1}{format_eta(queue.eta(job))}")
+    elif job.state == RUNNING:
+        st.progress(job.progress, text=f"🔨 Processing {label}: {job.done} of {job.total} images"
+                                       f"{format_eta(get_job_queue().eta(job))}")
+    elif job.state == FAILED:
+        for message in job.errors:
+            st.error(message)
+        st.error("❌ Failed to create PDF document" if job.kind == "pdf" else "❌ Failed to create ZIP archive")
+        show_performance(job)
+    elif job.id not in st.session_state.delivered_jobs:
+        st.session_state.delivered_jobs.add(job.id)
+        st.session_state.offered_download = job.id
+        for message in job.errors:
+            st.error(message)
+        data = job.read()
+        trigger_auto_download(data, job.filename, job.kind)
+        if job.kind == "pdf":
+            st.success("✅ PDF document created successfully!")
+        else:
+            st.success(f"✅ Archive created with {job.count} processed images!")
+        st.info("📥 Download will start automatically...")
+
+        # Create hidden download button for auto-download
+        st.download_button(
+            label=" ",
+            data=data,
+            file_name=job.filename,
+            mime=EXPORT_MIME_TYPES[job.kind],
+            key=f"auto_download_{job.id}",
+            use_container_width=True
+        )
+
+        # Auto-click JavaScript
+        st.markdown("""
+        <script>
+        setTimeout(function() {
+            const buttons = document.querySelectorAll('[data-testid="stDownloadButton"] button');
+            buttons.forEach(btn => {
+                if(btn.textContent.includes('Download') || btn.textContent.trim() === '') {
+                    btn.click();
+                }
+            });
+        }, 500);
+        </script>
+        """, unsafe_allow_html=True)
+        show_performance(job)
+    elif job.id == st.session_state.offered_download:
+        # Already delivered once; keep a manual button while the file is retained. The button
+        # carries the whole file on every rerun, so only one export at a time gets it
+        st.download_button(
+            label=f"💾 {job.filename}",
+            data=job.read(),
+            file_name=job.filename,
+            mime=EXPORT_MIME_TYPES[job.kind],
+            key=f"saved_{job.id}",
+            use_container_width=True
+        )
+        show_performance(job)
+    else:
+        if st.button(f"📥 Get {job.filename} again", key=f"offer_{job.id}", use_container_width=True):
+            st.session_state.offered_download = job.id
+            st.rerun()
+        show_performance(job)
+
+export_jobs = [get_job_queue().get(job_id) for job_id in st.session_state.export_jobs]
+# Jobs whose files have expired are forgotten
+export_jobs = [job for job in export_jobs if job is not None]
+st.session_state.export_jobs = [job.id for job in export_jobs]
+
+if export_jobs:
+    st.markdown("### 📦 EXPORTS")
+    for job in reversed(export_jobs):
+        show_export_job(job)
+
 # ------------------- COPYRIGHT FOOTER -------------------
 st.markdown("---")
 st.markdown("""
@@ -737,3 +697,8 @@ st.components.v1.html("""
     });
 </script>
 """, height=0)
+
+# Keep polling while this session has exports in progress
+if any(job.active for job in export_jobs):
+    time.sleep(JOB_POLL_SECONDS)
+    st.rerun()
@@ -0,0 +1 @@
+"""Processing components for the LFJC paper processor"""
@@ -0,0 +1,286 @@
+"""Benchmarks for the processing pipeline.
+
+    python -m lfjc.bench run [-o results.json] [--images N] [--size WxH] [--profile NAME] [--quick]
+    python -m lfjc.bench compare BASELINE.json CANDIDATE.json [--threshold 0.10]
+
+`run` generates seeded synthetic answer sheets, so every run sees identical input. It times
+each pipeline stage on its own and the PDF and ZIP exports end to end, and reports wall time,
+CPU time, peak RSS and output size per case as JSON. Every case runs in a fresh process, so
+the peak RSS is that case's own.
+
+`compare` lines up two result files and exits with status 1 when a case got slower, hungrier
+or larger than the threshold allows.
+"""
+import os, io, sys, json, time, shutil, argparse, platform, tempfile, statistics, dataclasses, multiprocessing
+from datetime import datetime, timezone
+import numpy as np
+import cv2
+import PIL
+from PIL import Image
+
+from lfjc.cache import ImageCache
+from lfjc.core import (Settings, MAX_WORKERS, decode_image, enhance_image_opencv, read_file_bytes, plan_pdf,
+                       prefetch_image, create_pdf, create_zip, create_both, find_font_path)
+from lfjc.fonts import load_pdf_font
+from lfjc.layout import scaled_dimensions
+from lfjc.metrics import peak_rss_mb
+from lfjc.pdf import jpeg_image, bilevel_image
+
+
+# ------------------- SYNTHETIC SHEETS -------------------
+def synthetic_sheet(width, height, seed, fmt="JPEG"):
+    """A photographed answer sheet: rows of handwriting-like strokes on off-white paper,
+    with uneven lighting and sensor noise"""
+    rng = np.random.default_rng(seed)
+    img = np.full((height, width, 3), 235, np.uint8)
+    scale = width / 2480
+    line_height = max(20, int(70 * scale))
+    for y in range(line_height, height - line_height // 2, line_height):
+        x = int(60 * scale)
+        while x < width - int(200 * scale) and rng.random() < 0.97:
+            word = "abcdexyz"[rng.integers(0, 8)] * int(rng.integers(1, 5))
+            cv2.putText(img, word, (x, y), cv2.FONT_HERSHEY_SCRIPT_SIMPLEX, 1.6 * scale, (30, 30, 60), max(1, int(3 * scale)))
+            x += int(rng.integers(120, 260) * scale)
+    shade = np.linspace(0.8, 1.0, width)[None, :, None] * np.linspace(0.9, 1.0, height)[:, None, None]
+    img = np.clip(img * shade + rng.normal(0, 9, img.shape), 0, 255).astype(np.uint8)
+    buffer = io.BytesIO()
+    Image.fromarray(img).save(buffer, fmt, **({"quality": 90} if fmt == "JPEG" else {}))
+    return buffer.getvalue()
+
+
+def write_sheets(directory, count, width, height, fmt):
+    files = []
+    extension = "jpg" if fmt == "JPEG" else "png"
+    for i in range(count):
+        path = os.path.join(directory, f"sheet{i + 1}.{extension}")
+        with open(path, "wb") as f:
+            f.write(synthetic_sheet(width, height, seed=i, fmt=fmt))
+        files.append({'name': os.path.basename(path), 'path': path})
+    return files
+
+
+# ------------------- CASES -------------------
+# Each case is (setup, run): setup prepares the stage's input outside the timed region and
+# run performs the stage, returning the output size in bytes or None.
+
+def read_all(files, settings):
+    return [read_file_bytes(f) for f in files]
+
+def decode_all(files, settings):
+    return [decode_image(read_file_bytes(f)) for f in files]
+
+def enhance_all(files, settings):
+    return [enhance_image_opencv(img, settings.enhancement_profile).convert('L') for img in decode_all(files, settings)]
+
+def resize_all(files, settings):
+    return [img.resize(scaled_dimensions(*img.size, settings.alignment), Image.Resampling.LANCZOS)
+            for img in enhance_all(files, settings)]
+
+def load_font(files, settings):
+    return files, load_pdf_font(find_font_path())
+
+def warm_cache(files, settings):
+    cache = ImageCache(tempfile.mkdtemp(prefix="lfjc-bench-"), 1024 ** 3, 8 * 1024 ** 3)
+    for f in files:
+        prefetch_image(f, settings, cache)
+    return files, cache
+
+def keep_files(files, settings):
+    return files
+
+def run_decode(data, settings):
+    for file_bytes in data:
+        decode_image(file_bytes)
+
+def run_enhance(images, settings):
+    for img in images:
+        enhance_image_opencv(img, settings.enhancement_profile)
+
+def run_resize(images, settings):
+    for img in images:
+        img.resize(scaled_dimensions(*img.size, settings.alignment), Image.Resampling.LANCZOS)
+
+def run_layout(state, settings):
+    plan_pdf(state[0], settings, state[1])
+
+def run_encode(images, settings):
+    encode = bilevel_image if settings.compact else jpeg_image
+    return sum(len(encode(img)[1]) for img in images)
+
+def run_pdf_cached(state, settings):
+    return len(create_pdf(state[0], settings, state[1]))
+
+def run_pdf(files, settings):
+    return len(create_pdf(files, settings))
+
+def run_pdf_compact(files, settings):
+    return len(create_pdf(files, dataclasses.replace(settings, compact=True)))
+
+def run_zip(files, settings):
+    return len(create_zip(files, settings)[0])
+
+def run_both(files, settings):
+    pdf, archive, _ = create_both(files, settings)
+    return len(pdf) + len(archive)
+
+CASES = {
+    "stage.decode": (read_all, run_decode),
+    "stage.enhance": (decode_all, run_enhance),
+    "stage.resize": (enhance_all, run_resize),
+    "stage.layout": (load_font, run_layout),
+    "stage.encode": (resize_all, run_encode),
+    # With every image already enhanced, what remains of a PDF export is layout, page composition and encoding
+    "pdf.compose": (warm_cache, run_pdf_cached),
+    "pdf": (keep_files, run_pdf),
+    "pdf.compact": (keep_files, run_pdf_compact),
+    "zip": (keep_files, run_zip),
+    # Both files from one pass: should cost about the slower of pdf and zip, not their sum
+    "both": (keep_files, run_both),
+}
+
+
+def run_case(name, files, settings, repeat):
+    """Worker entry point: set up and time one case"""
+    setup, run = CASES[name]
+    state = setup(files, settings)
+    walls, cpus, output = [], [], None
+    for _ in range(repeat):
+        wall_start, cpu_start = time.perf_counter(), time.process_time()
+        output = run(state, settings)
+        walls.append(time.perf_counter() - wall_start)
+        cpus.append(time.process_time() - cpu_start)
+    peak = peak_rss_mb()
+    if isinstance(state, tuple) and isinstance(state[-1], ImageCache):
+        shutil.rmtree(state[-1].directory, ignore_errors=True)
+    return {
+        "wall_s": round(statistics.median(walls), 4),
+        "cpu_s": round(statistics.median(cpus), 4),
+        "peak_rss_mb": round(peak, 1) if peak is not None else None,
+        "output_bytes": output,
+        "repeat": repeat,
+    }
+
+
+def run_benchmarks(args):
+    settings = Settings(exam_type="Semester I - Physics", exam_date="15-01-2024", strips=[("1-2", 1 / 8)],
+                        enhancement_profile=args.profile, workers=args.workers)
+    width, height = args.size
+    names = [name for name in CASES if not args.cases or any(name.startswith(prefix) for prefix in args.cases)]
+
+    directory = tempfile.mkdtemp(prefix="lfjc-bench-")
+    try:
+        files = write_sheets(directory, args.images, width, height, args.format)
+        results = {}
+        context = multiprocessing.get_context("spawn")
+        for name in names:
+            with context.Pool(1) as pool:
+                results[name] = pool.apply(run_case, (name, files, settings, args.repeat))
+            print(f"{name:<16} {results[name]['wall_s']:>9.3f}s wall {results[name]['cpu_s']:>9.3f}s cpu "
+                  f"{results[name]['peak_rss_mb'] or 0:>8.1f} MB", file=sys.stderr, flush=True)
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    return {
+        "meta": {
+            "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "versions": {"numpy": np.__version__, "opencv": cv2.__version__, "pillow": PIL.__version__},
+            "images": args.images,
+            "size": f"{width}x{height}",
+            "format": args.format,
+            "profile": args.profile,
+            "workers": args.workers,
+        },
+        "cases": results,
+    }
+
+
+# ------------------- COMPARISON -------------------
+COMPARED_METRICS = ("wall_s", "cpu_s", "peak_rss_mb", "output_bytes")
+
+
+def compare_results(baseline, candidate, threshold, min_seconds):
+    """Rows of (case, metric, old, new, relative change, regressed) for cases present in both"""
+    rows = []
+    for name, old in baseline["cases"].items():
+        new = candidate["cases"].get(name)
+        if new is None:
+            continue
+        for metric in COMPARED_METRICS:
+            if old.get(metric) is None or new.get(metric) is None:
+                continue
+            change = (new[metric] - old[metric]) / old[metric] if old[metric] else 0.0
+            regressed = change > threshold
+            # Sub-threshold timings are mostly scheduler noise
+            if metric in ("wall_s", "cpu_s") and new[metric] - old[metric] < min_seconds:
+                regressed = False
+            rows.append((name, metric, old[metric], new[metric], change, regressed))
+    return rows
+
+
+def print_comparison(rows):
+    print(f"{'case':<16} {'metric':<13} {'baseline':>12} {'candidate':>12} {'change':>8}")
+    for name, metric, old, new, change, regressed in rows:
+        print(f"{name:<16} {metric:<13} {old:>12} {new:>12} {change:>+8.1%}{'  REGRESSION' if regressed else ''}")
+
+
+# ------------------- COMMAND LINE -------------------
+def parse_size(text):
+    width, height = text.lower().split("x")
+    return int(width), int(height)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m lfjc.bench", description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run = commands.add_parser("run", help="run the benchmarks and write JSON results")
+    run.add_argument("-o", "--output", help="results file (default: stdout)")
+    run.add_argument("--images", type=int, default=4, help="sheets per case (default: 4)")
+    run.add_argument("--size", type=parse_size, default=(3000, 4000), help="sheet size in pixels (default: 3000x4000, a phone photo)")
+    run.add_argument("--format", choices=["JPEG", "PNG"], default="JPEG")
+    run.add_argument("--profile", default="quality", help="enhancement profile (default: quality)")
+    run.add_argument("--workers", type=int, default=MAX_WORKERS, help="image workers for the end-to-end cases")
+    run.add_argument("--repeat", type=int, default=1, help="runs per case; the median is reported")
+    run.add_argument("--case", dest="cases", action="append", help="only run cases starting with this name (repeatable)")
+    run.add_argument("--quick", action="store_true", help="2 small sheets with the fast profile, for a smoke test")
+
+    compare = commands.add_parser("compare", help="compare two result files and flag regressions")
+    compare.add_argument("baseline")
+    compare.add_argument("candidate")
+    compare.add_argument("--threshold", type=float, default=0.10, help="allowed relative increase (default: 0.10)")
+    compare.add_argument("--min-seconds", type=float, default=0.05, help="ignore timing increases smaller than this")
+
+    args = parser.parse_args(argv)
+
+    if args.command == "run":
+        if args.quick:
+            args.images, args.size, args.profile = 2, (1240, 1754), "fast"
+        results = json.dumps(run_benchmarks(args), indent=2)
+        if args.output:
+            with open(args.output, "w", encoding="utf-8") as f:
+                f.write(results + "\n")
+        else:
+            print(results)
+        return 0
+
+    with open(args.baseline, encoding="utf-8") as f:
+        baseline = json.load(f)
+    with open(args.candidate, encoding="utf-8") as f:
+        candidate = json.load(f)
+    for key in ("images", "size", "format", "profile", "workers", "cpu_count"):
+        if baseline["meta"].get(key) != candidate["meta"].get(key):
+            print(f"warning: runs differ in {key}: {baseline['meta'].get(key)} vs {candidate['meta'].get(key)}", file=sys.stderr)
+    rows = compare_results(baseline, candidate, args.threshold, args.min_seconds)
+    print_comparison(rows)
+    regressions = [row for row in rows if row[-1]]
+    if regressions:
+        print(f"\n{len(regressions)} regression{'s' if len(regressions) != 1 else ''} above {args.threshold:.0%}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
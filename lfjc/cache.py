@@ -0,0 +1,163 @@
+import os, hashlib, threading, tempfile
+from collections import OrderedDict
+from contextlib import contextmanager
+import numpy as np
+import cv2
+
+
+def content_key(data, *params):
+    """Hash of the source bytes plus every parameter that affects the result"""
+    digest = hashlib.sha256()
+    for param in params:
+        digest.update(repr(param).encode("utf-8"))
+        digest.update(b"\0")
+    digest.update(data)
+    return digest.hexdigest()
+
+
+class ImageCache:
+    """Two-tier LRU cache of image arrays: a bounded in-memory tier backed by a bounded disk tier.
+    Without a directory there is only the memory tier"""
+
+    def __init__(self, directory, memory_limit, disk_limit):
+        self.directory = directory
+        self.memory_limit = memory_limit
+        self.disk_limit = disk_limit
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()
+        self._memory_size = 0
+        self._disk = OrderedDict()
+        self._disk_size = 0
+        self._computing = {}
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+            self._load_disk_index()
+
+    def _load_disk_index(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(".png"):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.directory, name))
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, name[:-4], stat.st_size))
+        for _, key, size in sorted(entries):
+            self._disk[key] = size
+            self._disk_size += size
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + ".png")
+
+    def get(self, key):
+        with self._lock:
+            array = self._memory.get(key)
+            if array is not None:
+                self._memory.move_to_end(key)
+                return array
+            on_disk = key in self._disk
+
+        if on_disk:
+            try:
+                with open(self._path(key), "rb") as f:
+                    encoded = np.frombuffer(f.read(), np.uint8)
+                array = cv2.imdecode(encoded, cv2.IMREAD_UNCHANGED)
+                os.utime(self._path(key))
+            except OSError:
+                array = None
+            if array is not None:
+                array.flags.writeable = False
+                with self._lock:
+                    if key in self._disk:
+                        self._disk.move_to_end(key)
+                    self._remember(key, array)
+                return array
+            with self._lock:
+                self._forget_disk(key)
+        return None
+
+    def put(self, key, array):
+        array = np.ascontiguousarray(array)
+        array.flags.writeable = False
+        with self._lock:
+            self._remember(key, array)
+            if self.directory is None or key in self._disk:
+                return
+
+        ok, encoded = cv2.imencode(".png", array, [cv2.IMWRITE_PNG_COMPRESSION, 1])
+        if not ok:
+            return
+        # Write under a temporary name first so other sessions never read a half-written file
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(encoded.tobytes())
+            os.replace(tmp_path, self._path(key))
+        except OSError:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            return
+
+        with self._lock:
+            # Another writer may have stored the same key meanwhile; its file was just replaced
+            self._forget_disk(key)
+            self._disk[key] = len(encoded)
+            self._disk_size += len(encoded)
+            self._evict_disk()
+
+    def get_or_compute(self, key, compute):
+        array = self.get(key)
+        if array is None:
+            with self.computing(key):
+                array = self.get(key)
+                if array is None:
+                    array = compute()
+                    self.put(key, array)
+        return array
+
+    @contextmanager
+    def computing(self, key):
+        """Hold while producing the value for key, so concurrent requests for the same key
+        wait for the first one instead of repeating the work"""
+        with self._lock:
+            entry = self._computing.get(key)
+            if entry is None:
+                entry = self._computing[key] = [threading.Lock(), 0]
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self._lock:
+                entry[1] -= 1
+                if not entry[1]:
+                    del self._computing[key]
+
+    def _remember(self, key, array):
+        if key in self._memory:
+            self._memory.move_to_end(key)
+            return
+        if array.nbytes > self.memory_limit:
+            return
+        self._memory[key] = array
+        self._memory_size += array.nbytes
+        while self._memory_size > self.memory_limit:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_size -= evicted.nbytes
+
+    def _forget_disk(self, key):
+        size = self._disk.pop(key, None)
+        if size is not None:
+            self._disk_size -= size
+
+    def _evict_disk(self):
+        while self._disk_size > self.disk_limit and self._disk:
+            key, size = self._disk.popitem(last=False)
+            self._disk_size -= size
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
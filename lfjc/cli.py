@@ -0,0 +1,242 @@
+"""Batch processing of answer-sheet papers without the web app.
+
+    python -m lfjc.cli INPUT OUTPUT [options]
+
+INPUT is either a directory tree, where every directory that holds images is one paper,
+or a JSON Lines manifest with one paper per line:
+
+    {"name": "physics/12A", "images": "scans/12A", "exam_type": "Semester I - Physics", "exam_date": "15-01-2024"}
+
+"images" is a directory or a list of image paths, relative to the manifest. Any Settings
+field may be given per paper and overrides the command-line defaults.
+
+Papers run in parallel, one per process. Finished papers are recorded in OUTPUT/.lfjc-batch.jsonl
+and skipped on the next run as long as their images and settings are unchanged, so an
+interrupted batch can simply be started again.
+"""
+import os, sys, json, time, hashlib, argparse, tempfile, dataclasses
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from lfjc.cache import ImageCache
+from lfjc.layout import PACKING_MODES
+from lfjc.core import Settings, MAX_WORKERS, ENHANCEMENT_PROFILES, natural_sort_key, sort_files, write_pdf, write_zip, write_both
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+JOURNAL_NAME = ".lfjc-batch.jsonl"
+
+
+def parse_ratio(text):
+    if '/' in text:
+        numerator, denominator = text.split('/')
+        return float(numerator) / float(denominator)
+    return float(text)
+
+
+def parse_strip(text):
+    qnos_str, _, ratio = text.rpartition(':')
+    if not qnos_str:
+        raise argparse.ArgumentTypeError(f"expected RANGES:RATIO, got {text!r}")
+    return (qnos_str, parse_ratio(ratio))
+
+
+def image_files(directory):
+    names = [name for name in os.listdir(directory) if name.lower().endswith(IMAGE_EXTENSIONS)]
+    return [{'name': name, 'path': os.path.join(directory, name)} for name in sorted(names, key=natural_sort_key)]
+
+
+def discover_tree(root):
+    papers = []
+    for directory, subdirs, _ in os.walk(root):
+        subdirs.sort()
+        files = image_files(directory)
+        if files:
+            name = os.path.relpath(directory, root)
+            if name == '.':
+                name = os.path.basename(os.path.abspath(root))
+            papers.append({'name': name, 'files': files, 'defaults': {'exam_type': os.path.basename(directory)}, 'overrides': {}})
+    return papers
+
+
+def read_manifest(path):
+    papers = []
+    base = os.path.dirname(os.path.abspath(path))
+    fields = {f.name for f in dataclasses.fields(Settings)}
+    with open(path, encoding='utf-8') as f:
+        for line_number, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            entry = json.loads(line)
+            images = entry.pop('images')
+            name = entry.pop('name')
+            unknown = set(entry) - fields
+            if unknown:
+                raise ValueError(f"{path}:{line_number}: unknown settings {', '.join(sorted(unknown))}")
+            if isinstance(images, str):
+                files = image_files(os.path.join(base, images))
+            else:
+                # Numbered in the same natural order as a directory, whatever order they are listed in
+                files = sort_files({'name': os.path.basename(p), 'path': os.path.join(base, p)} for p in images)
+            if 'strips' in entry:
+                entry['strips'] = [(qnos, parse_ratio(str(ratio))) for qnos, ratio in entry['strips']]
+            papers.append({'name': name, 'files': files, 'defaults': {}, 'overrides': entry})
+    return papers
+
+
+def fingerprint(paper, settings, kinds):
+    digest = hashlib.sha256()
+    digest.update(repr((dataclasses.astuple(settings)[:-1], kinds)).encode('utf-8'))
+    for file_info in paper['files']:
+        stat = os.stat(file_info['path'])
+        digest.update(f"{file_info['name']}\0{stat.st_size}\0{stat.st_mtime_ns}\n".encode('utf-8'))
+    return digest.hexdigest()
+
+
+def load_journal(output_root):
+    done = {}
+    path = os.path.join(output_root, JOURNAL_NAME)
+    if os.path.exists(path):
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue  # a line cut short by a crash
+                done[entry['name']] = entry
+    return done
+
+
+def write_atomically(path, write):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.part')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            result = write(f)
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return result
+
+
+def process_paper(paper, settings, output_root, kinds, cache_dir):
+    """Worker entry point: build the requested outputs for one paper"""
+    started = time.time()
+    errors = []
+    cache = ImageCache(cache_dir, 256 * 1024 * 1024, 4 * 1024 ** 3) if cache_dir else None
+    outputs = {}
+    base = os.path.join(output_root, paper['name'])
+    if kinds == ('pdf', 'zip'):
+        # Made together, every image is decoded and enhanced once for both files
+        outputs['pdf'], outputs['zip'] = write_atomically(base + '.pdf', lambda pdf_file: write_atomically(
+            base + '.zip', lambda zip_file: write_both(paper['files'], settings, pdf_file, zip_file, cache, errors.append)))
+    elif 'pdf' in kinds:
+        outputs['pdf'] = write_atomically(base + '.pdf', lambda f: write_pdf(paper['files'], settings, f, cache, errors.append))
+    else:
+        outputs['zip'] = write_atomically(base + '.zip', lambda f: write_zip(paper['files'], settings, f, cache, errors.append))
+    return outputs, errors, time.time() - started
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="python -m lfjc.cli", description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("input", help="directory tree of papers, or a .jsonl manifest")
+    parser.add_argument("output", help="directory for the generated PDFs and ZIPs")
+    parser.add_argument("--pdf", action="store_true", help="write a PDF per paper (default when neither --pdf nor --zip is given)")
+    parser.add_argument("--zip", action="store_true", help="write a ZIP of processed images per paper")
+    parser.add_argument("--exam-type", help="header exam line; defaults to each paper's directory name")
+    parser.add_argument("--exam-date", default="")
+    parser.add_argument("--alignment", choices=["Center", "Left", "Right"], default="Center")
+    parser.add_argument("--strip", action="append", type=parse_strip, default=[], metavar="RANGES:RATIO",
+                        help="blank a left strip, e.g. 1-5:1/8 (repeatable)")
+    parser.add_argument("--numbering", default="", help="custom numbering, e.g. 1-5:1,6-10:41")
+    parser.add_argument("--skip", default="", help="images to skip from numbering, e.g. 2,4-5")
+    parser.add_argument("--profile", choices=sorted(ENHANCEMENT_PROFILES), default="quality")
+    parser.add_argument("--denoise-at-output", action="store_true")
+    parser.add_argument("--scale-first", action="store_true")
+    parser.add_argument("--detect-document", action="store_true", help="crop each photo to the answer sheet and straighten it")
+    parser.add_argument("--trim-bottom", action="store_true", help="drop blank space below the last written line")
+    parser.add_argument("--compact", action="store_true", help="black-and-white compact PDF")
+    parser.add_argument("--packing", choices=PACKING_MODES, default="greedy",
+                        help="fit: keep short questions whole and split long ones between lines of writing")
+    parser.add_argument("--jobs", type=int, default=MAX_WORKERS, help="papers processed at once (default: all cores)")
+    parser.add_argument("--cache", metavar="DIR", help="reuse enhanced images from this cache directory")
+    parser.add_argument("--force", action="store_true", help="redo papers that are already finished")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    kinds = tuple(kind for kind in ('pdf', 'zip') if getattr(args, kind)) or ('pdf',)
+
+    if os.path.isdir(args.input):
+        papers = discover_tree(args.input)
+    else:
+        papers = read_manifest(args.input)
+
+    base_settings = Settings(
+        exam_date=args.exam_date,
+        alignment=args.alignment,
+        strips=args.strip,
+        multi_numbering=args.numbering,
+        skip_numbering=args.skip,
+        enhancement_profile=args.profile,
+        denoise_at_output=args.denoise_at_output,
+        scale_first=args.scale_first,
+        detect_document=args.detect_document,
+        trim_bottom=args.trim_bottom,
+        compact=args.compact,
+        packing=args.packing,
+        # Papers already run one per core, so each paper works on a single thread
+        workers=1,
+    )
+
+    os.makedirs(args.output, exist_ok=True)
+    done = {} if args.force else load_journal(args.output)
+    pending = []
+    for paper in papers:
+        fields = dict(paper['defaults'])
+        if args.exam_type is not None:
+            fields['exam_type'] = args.exam_type
+        fields.update(paper['overrides'])
+        settings = dataclasses.replace(base_settings, **fields)
+        paper_fingerprint = fingerprint(paper, settings, kinds)
+        previous = done.get(paper['name'])
+        outputs_exist = all(os.path.exists(os.path.join(args.output, paper['name'] + '.' + kind)) for kind in kinds)
+        if previous and previous.get('fingerprint') == paper_fingerprint and outputs_exist:
+            continue
+        pending.append((paper, settings, paper_fingerprint))
+
+    print(f"{len(papers)} papers found, {len(papers) - len(pending)} already done, {len(pending)} to process", flush=True)
+    if not pending:
+        return 0
+
+    failures = 0
+    journal_path = os.path.join(args.output, JOURNAL_NAME)
+    with open(journal_path, 'a', encoding='utf-8') as journal, ProcessPoolExecutor(max_workers=max(1, args.jobs)) as pool:
+        futures = {
+            pool.submit(process_paper, paper, settings, args.output, kinds, args.cache): (paper, paper_fingerprint)
+            for paper, settings, paper_fingerprint in pending
+        }
+        for finished, future in enumerate(as_completed(futures), start=1):
+            paper, paper_fingerprint = futures[future]
+            try:
+                outputs, errors, elapsed = future.result()
+            except Exception as e:
+                failures += 1
+                print(f"[{finished}/{len(pending)}] {paper['name']}: FAILED: {e}", file=sys.stderr, flush=True)
+                continue
+            for message in errors:
+                print(f"  {paper['name']}: {message}", file=sys.stderr)
+            journal.write(json.dumps({'name': paper['name'], 'fingerprint': paper_fingerprint, 'outputs': outputs}) + "\n")
+            journal.flush()
+            os.fsync(journal.fileno())
+            summary = ", ".join(f"{kind} {count}" for kind, count in outputs.items())
+            print(f"[{finished}/{len(pending)}] {paper['name']}: {summary} ({elapsed:.1f}s)", flush=True)
+
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
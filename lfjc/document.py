@@ -0,0 +1,159 @@
+"""Finding the answer sheet in a phone photo.
+
+Detection works on a small greyscale copy of the photo: the sheet is the largest bright
+four-sided shape, and the written part of it ends at the last row with ink on it. The result
+is a Region in the photo's own pixels, which decoding then cuts out of the full-size image,
+straightening it if the sheet was photographed at an angle, along with the ink profile of
+that part, which tells the page layout where it can split the image without cutting
+through writing."""
+from collections import namedtuple
+import numpy as np
+import cv2
+
+DETECT_WIDTH = 640
+MIN_SHEET_AREA = 0.25  # smaller bright shapes are not taken for the sheet
+FULL_FRAME_AREA = 0.95  # a sheet this large already fills the photo
+INK_ROW_FRACTION = 0.004  # share of a row that must be ink for the row to count as written on
+TRIM_MARGIN = 0.03  # blank space kept below the last written row, as a share of the width
+
+# The part of a photo to keep. corners are the sheet's corners in photo pixels, clockwise from
+# top-left, or None for the photo's own edges; width and height are the size of the result,
+# the height already trimmed.
+Region = namedtuple("Region", "corners width height")
+# Integers a packed region takes ahead of its profile: its kind, then ten fields of two each
+PACKED_REGION_SIZE = 21
+
+
+def order_corners(points):
+    """Four points ordered top-left, top-right, bottom-right, bottom-left"""
+    points = np.asarray(points, np.float64).reshape(4, 2)
+    total = points.sum(axis=1)
+    difference = points[:, 1] - points[:, 0]
+    return points[[np.argmin(total), np.argmin(difference), np.argmax(total), np.argmax(difference)]]
+
+
+def find_sheet(gray):
+    """Corners of the sheet in a greyscale photo, or None when it fills the photo already or
+    cannot be told apart from what surrounds it"""
+    height, width = gray.shape
+    _, paper = cv2.threshold(cv2.GaussianBlur(gray, (5, 5), 0), 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    # Close the holes the writing leaves in the paper
+    paper = cv2.morphologyEx(paper, cv2.MORPH_CLOSE, cv2.getStructuringElement(cv2.MORPH_RECT, (15, 15)))
+    contours, _ = cv2.findContours(paper, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    if not contours:
+        return None
+    hull = cv2.convexHull(max(contours, key=cv2.contourArea))
+    if not MIN_SHEET_AREA * width * height <= cv2.contourArea(hull) < FULL_FRAME_AREA * width * height:
+        return None
+    corners = cv2.approxPolyDP(hull, 0.02 * cv2.arcLength(hull, True), True)
+    if len(corners) != 4:
+        corners = cv2.boxPoints(cv2.minAreaRect(hull))
+    return order_corners(corners)
+
+
+def straightened_size(corners):
+    """Width and height of the sheet between corners once straightened"""
+    top_left, top_right, bottom_right, bottom_left = np.asarray(corners, np.float64)
+    width = max(np.linalg.norm(top_right - top_left), np.linalg.norm(bottom_right - bottom_left))
+    height = max(np.linalg.norm(bottom_left - top_left), np.linalg.norm(bottom_right - top_right))
+    return width, height
+
+
+def straighten(pixels, corners, size):
+    """Warp the sheet between corners upright into an image size (width, height) wide; a height
+    short of the sheet's cuts off its bottom"""
+    full_width, full_height = straightened_size(corners)
+    scale = size[0] / full_width
+    target = np.float32([[0, 0], [size[0], 0], [size[0], full_height * scale], [0, full_height * scale]])
+    matrix = cv2.getPerspectiveTransform(np.float32(corners), target)
+    return cv2.warpPerspective(pixels, matrix, tuple(size), flags=cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE)
+
+
+def ink_profile(gray):
+    """Number of ink pixels in each row of a greyscale sheet"""
+    height, width = gray.shape
+    ink = cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_MEAN_C, cv2.THRESH_BINARY_INV, 25, 15)
+    # A ruled margin runs down the whole sheet and would mark every row as written on
+    ink &= ~cv2.morphologyEx(ink, cv2.MORPH_OPEN, cv2.getStructuringElement(cv2.MORPH_RECT, (1, max(3, height // 20))))
+    # Straightening can leave a sliver of desk along the edges
+    margin = max(1, width // 50)
+    return np.count_nonzero(ink[:, margin:width - margin], axis=1)
+
+
+def blank_rows(profile, width):
+    """Which rows of an ink profile measured on an image width pixels wide have no writing"""
+    return np.asarray(profile) <= INK_ROW_FRACTION * width
+
+
+def last_written_row(profile, width):
+    """Index of the last row with writing on it in the ink profile of a sheet width pixels wide,
+    or None if it is blank"""
+    # As along the sides, the bottom rows can be desk
+    written = np.flatnonzero(~blank_rows(profile[:len(profile) - max(1, width // 50)], width))
+    return int(written[-1]) if len(written) else None
+
+
+def find_region(gray, source_size, detect=True, trim=False):
+    """Region to keep of a photo source_size (width, height) pixels, given gray, a reduced
+    greyscale copy of it, and the ink profile of that region on the reduced copy. The region
+    is None when the whole photo is kept as it is"""
+    source_width, source_height = source_size
+    factor = source_width / gray.shape[1]
+    corners = find_sheet(gray) if detect else None
+    if corners is not None:
+        sheet = straighten(gray, corners, [max(1, round(value)) for value in straightened_size(corners)])
+        # The fitted corners of a rotated sheet can fall just outside the photo
+        corners = np.clip(np.round(corners * factor), 0, source_size)
+        width, height = straightened_size(corners)
+    else:
+        sheet = gray
+        width, height = source_width, source_height
+
+    profile = ink_profile(sheet)
+    if trim:
+        row = last_written_row(profile, sheet.shape[1])
+        if row is not None:
+            trimmed = min(height, (row + 1) / len(profile) * height + TRIM_MARGIN * width)
+            profile = profile[:max(1, round(len(profile) * trimmed / height))]
+            height = trimmed
+
+    if corners is None and round(height) >= source_height:
+        return None, profile
+    corners = None if corners is None else tuple((int(x), int(y)) for x, y in corners)
+    return Region(corners, max(1, round(width)), max(1, round(height))), profile
+
+
+def cut_region(pixels, region, scale=1.0):
+    """The region of pixels, an image decoded at scale times the photo's size"""
+    width, height = max(1, round(region.width * scale)), max(1, round(region.height * scale))
+    if region.corners is None:
+        return pixels[:height, :width]
+    return straighten(pixels, np.array(region.corners, np.float64) * scale, (width, height))
+
+
+def pack_region(region, profile):
+    """Region and its ink profile as one row of integers, the form the image cache stores. The
+    cache keeps 16-bit integers, so each region field takes two, the high half first"""
+    if region is None:
+        fields = [0] * 10
+    else:
+        fields = [*np.ravel(region.corners or ((0, 0),) * 4), region.width, region.height]
+    fields = np.array(fields, np.int64)
+    if fields.min() < 0 or fields.max() >= 1 << 32:
+        raise ValueError(f"Region {region} does not fit the cache")
+    kind = 0 if region is None else 1 if region.corners else 2
+    words = np.column_stack([fields >> 16, fields & 0xFFFF]).ravel()
+    return np.concatenate([[kind], words, profile]).astype(np.uint16)[None, :]
+
+
+def unpack_region(array):
+    """Region and ink profile from pack_region"""
+    array = np.ravel(array)
+    kind = int(array[0])
+    high, low = array[1:PACKED_REGION_SIZE:2].astype(np.int64), array[2:PACKED_REGION_SIZE:2].astype(np.int64)
+    values = [int(value) for value in (high << 16) | low]
+    profile = array[PACKED_REGION_SIZE:]
+    if kind == 0:
+        return None, profile
+    corners = tuple(zip(values[0:8:2], values[1:8:2])) if kind == 1 else None
+    return Region(corners, values[8], values[9]), profile
@@ -0,0 +1,207 @@
+import io, zlib, hashlib, functools, threading
+from lfjc.pdf import Name
+
+# Helvetica advance widths for ASCII 32-126, in 1/1000 em
+HELVETICA_WIDTHS = [
+    278, 278, 355, 556, 556, 889, 667, 191, 333, 333, 389, 584, 278, 333, 278, 278,
+    556, 556, 556, 556, 556, 556, 556, 556, 556, 556, 278, 278, 584, 584, 584, 556,
+    1015, 667, 667, 722, 722, 667, 611, 778, 722, 278, 500, 667, 556, 833, 722, 778,
+    667, 778, 722, 667, 611, 722, 667, 944, 667, 667, 611, 278, 278, 278, 469, 556,
+    333, 556, 556, 500, 556, 556, 278, 556, 556, 222, 222, 500, 222, 833, 556, 556,
+    556, 556, 333, 500, 278, 556, 500, 722, 500, 500, 500, 334, 260, 334, 584,
+]
+
+
+class StandardFont:
+    """Built-in Helvetica, used when no TrueType font is installed; only Latin-1 text survives"""
+
+    ascent, descent = 718, -207
+
+    def encode(self, text):
+        return text.encode("latin-1", "replace")
+
+    def width(self, text, size):
+        return sum(HELVETICA_WIDTHS[ord(c) - 32] if 32 <= ord(c) < 127 else 556 for c in text) * size / 1000
+
+    def ink_height(self, text, size):
+        return (self.ascent - self.descent) * size / 1000
+
+    def text_ascent(self, size):
+        return self.ascent * size / 1000
+
+    def show(self, text):
+        escaped = self.encode(text).replace(b"\\", b"\\\\").replace(b"(", b"\\(").replace(b")", b"\\)")
+        return b"(" + escaped + b") Tj"
+
+    def write(self, writer, ref):
+        writer.add_object({
+            "Type": Name("Font"),
+            "Subtype": Name("Type1"),
+            "BaseFont": Name("Helvetica"),
+            "Encoding": Name("WinAnsiEncoding"),
+        }, ref=ref)
+
+
+class FontFace:
+    """The parsed tables of a TrueType file that text layout needs. Parsing costs tens of
+    milliseconds, so each file is parsed once and shared by every export"""
+
+    def __init__(self, path):
+        from fontTools.ttLib import TTFont
+        tt = TTFont(path)
+        self.path = path
+        self.cmap = tt.getBestCmap()
+        self.units = tt["head"].unitsPerEm
+        self.metrics = tt["hmtx"].metrics
+        self.ascent = tt["hhea"].ascent
+        self.descent = tt["hhea"].descent
+        head = tt["head"]
+        self.bbox = (head.xMin, head.yMin, head.xMax, head.yMax)
+        self.postscript_name = tt["name"].getDebugName(6) or "Font"
+        self.glyph_order = tt.getGlyphOrder()
+        self.glyph_ids = {name: gid for gid, name in enumerate(self.glyph_order)}
+        self._tt = tt
+        self._glyf = tt["glyf"] if "glyf" in tt else None
+        self._bounds = {}
+        # fontTools expands glyphs lazily, which is not safe from several threads at once
+        self._lock = threading.Lock()
+
+    def glyph_bounds(self, name):
+        """(yMin, yMax) of a glyph's outline, or None for an empty glyph"""
+        with self._lock:
+            if name not in self._bounds:
+                glyph = self._glyf[name] if self._glyf is not None else None
+                self._bounds[name] = (glyph.yMin, glyph.yMax) if glyph is not None and glyph.numberOfContours else None
+            return self._bounds[name]
+
+
+@functools.lru_cache(maxsize=None)
+def load_face(path):
+    return FontFace(path)
+
+
+@functools.lru_cache(maxsize=32)
+def subset_font(path, gids):
+    """Font file reduced to the glyph ids given, keeping their ids; successive exports mostly use
+    the same glyphs, so recent results are kept"""
+    from fontTools import subset
+    options = subset.Options()
+    options.retain_gids = True
+    options.notdef_outline = True
+    options.name_IDs = ["*"]
+    options.drop_tables += ["GSUB", "GPOS", "GDEF", "kern", "FFTM"]
+    font = subset.load_font(path, options)
+    subsetter = subset.Subsetter(options)
+    subsetter.populate(gids=list(gids))
+    subsetter.subset(font)
+    buffer = io.BytesIO()
+    font.save(buffer)
+    return buffer.getvalue()
+
+
+class TrueTypeFont:
+    """A TrueType font embedded as a CID-keyed Type 0 font, subset to the glyphs actually drawn"""
+
+    def __init__(self, path):
+        self.path = path
+        self._face = load_face(path)
+        self.ascent = self._face.ascent
+        self.descent = self._face.descent
+        self._units = self._face.units
+        self._used = {}
+
+    def _glyphs(self, text):
+        return [(char, self._face.cmap.get(ord(char), ".notdef")) for char in text]
+
+    def width(self, text, size):
+        return sum(self._face.metrics[name][0] for _, name in self._glyphs(text)) * size / self._units
+
+    def ink_height(self, text, size):
+        bounds = [b for b in (self._face.glyph_bounds(name) for _, name in self._glyphs(text)) if b is not None]
+        if not bounds:
+            return (self.ascent - self.descent) * size / self._units
+        return (max(top for _, top in bounds) - min(bottom for bottom, _ in bounds)) * size / self._units
+
+    def text_ascent(self, size):
+        return self.ascent * size / self._units
+
+    def show(self, text):
+        gids = []
+        for char, name in self._glyphs(text):
+            gid = self._face.glyph_ids[name]
+            self._used.setdefault(gid, char)
+            gids.append(gid)
+        return b"<" + "".join("%04X" % gid for gid in gids).encode("ascii") + b"> Tj"
+
+    def _subset(self):
+        return subset_font(self.path, tuple(sorted(set(self._used) | {0})))
+
+    def _to_unicode(self):
+        lines = [
+            "/CIDInit /ProcSet findresource begin", "12 dict begin", "begincmap",
+            "/CIDSystemInfo << /Registry (Adobe) /Ordering (UCS) /Supplement 0 >> def",
+            "/CMapName /Adobe-Identity-UCS def", "/CMapType 2 def",
+            "1 begincodespacerange", "<0000> <FFFF>", "endcodespacerange",
+        ]
+        entries = sorted(self._used.items())
+        for start in range(0, len(entries), 100):
+            chunk = entries[start:start + 100]
+            lines.append("%d beginbfchar" % len(chunk))
+            for gid, char in chunk:
+                lines.append("<%04X> <%s>" % (gid, char.encode("utf-16-be").hex().upper()))
+            lines.append("endbfchar")
+        lines += ["endcmap", "CMapName currentdict /CMap defineresource pop", "end", "end"]
+        return "\n".join(lines).encode("ascii")
+
+    def write(self, writer, ref):
+        scale = 1000 / self._units
+        x_min, y_min, x_max, y_max = self._face.bbox
+        tag = "".join(chr(65 + b % 26) for b in hashlib.md5(repr(sorted(self._used)).encode()).digest()[:6])
+        base_name = Name("%s+%s" % (tag, self._face.postscript_name))
+
+        font_data = self._subset()
+        font_file = writer.add_object({"Length1": len(font_data), "Filter": Name("FlateDecode")}, zlib.compress(font_data))
+        descriptor = writer.add_object({
+            "Type": Name("FontDescriptor"),
+            "FontName": base_name,
+            "Flags": 32,
+            "FontBBox": [int(x_min * scale), int(y_min * scale), int(x_max * scale), int(y_max * scale)],
+            "ItalicAngle": 0,
+            "Ascent": int(self.ascent * scale),
+            "Descent": int(self.descent * scale),
+            "CapHeight": int(self.ascent * scale),
+            "StemV": 80,
+            "FontFile2": font_file,
+        })
+        widths = []
+        for gid in sorted(self._used):
+            name = self._face.glyph_order[gid]
+            widths += [gid, [int(round(self._face.metrics[name][0] * scale))]]
+        cid_font = writer.add_object({
+            "Type": Name("Font"),
+            "Subtype": Name("CIDFontType2"),
+            "BaseFont": base_name,
+            "CIDSystemInfo": {"Registry": b"Adobe", "Ordering": b"Identity", "Supplement": 0},
+            "FontDescriptor": descriptor,
+            "W": widths,
+            "CIDToGIDMap": Name("Identity"),
+        })
+        to_unicode = writer.add_object({}, self._to_unicode())
+        writer.add_object({
+            "Type": Name("Font"),
+            "Subtype": Name("Type0"),
+            "BaseFont": base_name,
+            "Encoding": Name("Identity-H"),
+            "DescendantFonts": [cid_font],
+            "ToUnicode": to_unicode,
+        }, ref=ref)
+
+
+def load_pdf_font(path):
+    """Embeddable font for the TrueType file at path, or built-in Helvetica when there is none"""
+    if path:
+        try:
+            return TrueTypeFont(path)
+        except Exception:
+            pass
+    return StandardFont()
@@ -0,0 +1,57 @@
+import time, heapq, itertools, threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+
+from lfjc.metrics import NO_METRICS
+
+# Peak memory of decoding and enhancing an image, per pixel of the result. An 80 MP scan
+# peaks at about 780 MB.
+BYTES_PER_PIXEL = 10
+
+
+class Governor:
+    """Server-wide limits on image processing, shared by every session and export.
+
+    Exports run their images on one pool of worker threads instead of a pool each. Every image
+    is also admitted before it is decoded: at most `workers` are processed at a time, and their
+    estimated peak memory has to fit memory_budget, except that an image larger than the whole
+    budget is let through alone. Images are admitted in the order they ask, with background
+    work (prefetching) behind everything an export is waiting for."""
+
+    def __init__(self, workers, memory_budget):
+        self.workers = workers
+        self.memory_budget = memory_budget
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="lfjc-image")
+        self._condition = threading.Condition()
+        self._running = 0
+        self._reserved = 0
+        self._waiting = []
+        self._order = itertools.count()
+
+    def _fits(self, ticket, cost):
+        return (self._waiting[0] is ticket and self._running < self.workers and
+                (not self._running or self._reserved + cost <= self.memory_budget))
+
+    @contextmanager
+    def admit(self, pixels, background=False, metrics=NO_METRICS, item=None):
+        """Hold while processing an image of pixels pixels, waiting for a worker and memory to be
+        free. Time spent waiting is recorded as the "admit" stage of metrics"""
+        cost = pixels * BYTES_PER_PIXEL
+        ticket = (background, next(self._order))
+        start = time.perf_counter()
+        with self._condition:
+            heapq.heappush(self._waiting, ticket)
+            self._condition.wait_for(lambda: self._fits(ticket, cost))
+            heapq.heappop(self._waiting)
+            self._running += 1
+            self._reserved += cost
+            # The next in line may fit as well
+            self._condition.notify_all()
+        metrics.add("admit", item, time.perf_counter() - start, pixels)
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._running -= 1
+                self._reserved -= cost
+                self._condition.notify_all()
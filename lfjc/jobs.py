@@ -0,0 +1,238 @@
+import os, time, uuid, heapq, logging, tempfile, threading
+from contextlib import ExitStack
+from concurrent.futures import ThreadPoolExecutor
+
+from lfjc.core import MAX_WORKERS, write_pdf, write_zip, write_both, prefetch_image
+from lfjc.governor import Governor
+from lfjc.metrics import Metrics
+
+logger = logging.getLogger(__name__)
+
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+
+EXPORTERS = {"pdf": write_pdf, "zip": write_zip}
+FAILURE_MESSAGES = {"pdf": "PDF Creation Error", "zip": "Archive Creation Error"}
+# Weight of the latest finished export in the time per image that estimates are made from
+ESTIMATE_SMOOTHING = 0.3
+
+
+class Job:
+    """One export request: its progress while it runs and its output file once finished"""
+
+    def __init__(self, kind, filename, files, settings):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.filename = filename
+        self.batch = self.id  # jobs made in the same run share a batch
+        self.state = QUEUED
+        self.done = 0
+        self.total = len(files)
+        self.count = 0  # pages in the PDF or images in the ZIP
+        self.errors = []
+        self.path = None
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+        self.metrics = Metrics()
+        self._files = files
+        self._settings = settings
+
+    @property
+    def active(self):
+        return self.state in (QUEUED, RUNNING)
+
+    @property
+    def progress(self):
+        if self.state == DONE:
+            return 1.0
+        return self.done / self.total if self.total else 0.0
+
+    def _on_progress(self, done, total):
+        self.done, self.total = done, total
+
+    def read(self):
+        with open(self.path, "rb") as f:
+            return f.read()
+
+
+class JobQueue:
+    """Runs exports on a bounded pool of background threads so no script run waits on them.
+    Jobs outlive the browser connection that started them; finished files stay on disk for
+    keep_seconds and are then removed. All image work, exports and prefetching alike, goes
+    through one governor, so the server's load does not grow with the number of sessions"""
+
+    def __init__(self, directory, max_running, keep_seconds, cache=None, governor=None):
+        self.directory = directory
+        self.max_running = max_running
+        self.keep_seconds = keep_seconds
+        self.cache = cache
+        self.governor = governor if governor is not None else Governor(MAX_WORKERS, float("inf"))
+        self._lock = threading.Lock()
+        self._jobs = {}
+        self._seconds_per_image = None
+        # Each job spreads its images over the governor's pool, so only a few run at once
+        self._pool = ThreadPoolExecutor(max_workers=max_running, thread_name_prefix="lfjc-job")
+        # Prefetches only wait here; the governor admits their images after any an export needs
+        self._prefetch_pool = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="lfjc-prefetch")
+        os.makedirs(directory, exist_ok=True)
+        self._remove_stale_files()
+
+    def _remove_stale_files(self):
+        # Outputs left behind by a previous server process can no longer be claimed by anyone
+        cutoff = time.time() - self.keep_seconds
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            try:
+                if os.stat(path).st_mtime < cutoff:
+                    os.remove(path)
+            except OSError:
+                pass
+
+    def submit(self, kind, files, settings, filename):
+        """Queue an export of files ("pdf" or "zip") and return its job id"""
+        self._purge()
+        job = Job(kind, filename, list(files), settings)
+        with self._lock:
+            self._jobs[job.id] = job
+        self._pool.submit(self._run, job)
+        return job.id
+
+    def submit_both(self, files, settings, pdf_filename, zip_filename):
+        """Queue a PDF and a ZIP of the same files as one run that enhances every image once;
+        returns the two job ids"""
+        self._purge()
+        files = list(files)
+        jobs = (Job("pdf", pdf_filename, files, settings), Job("zip", zip_filename, files, settings))
+        jobs[1].batch = jobs[0].batch
+        with self._lock:
+            for job in jobs:
+                self._jobs[job.id] = job
+        self._pool.submit(self._run, *jobs)
+        return tuple(job.id for job in jobs)
+
+    def prefetch(self, files, settings):
+        """Start enhancing files into the cache so a later export only has to lay out and encode"""
+        if self.cache is None:
+            return
+        for file_info in files:
+            self._prefetch_pool.submit(self._prefetch_one, file_info, settings)
+
+    def _prefetch_one(self, file_info, settings):
+        try:
+            prefetch_image(file_info, settings, self.cache, self.governor)
+        except Exception:
+            # The export will hit the same problem and report it
+            logger.debug("Prefetch of %s failed", file_info['name'], exc_info=True)
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def position(self, job):
+        """Number of runs that will start before a queued job"""
+        with self._lock:
+            return len({other.batch for other in self._jobs.values()
+                        if other.state == QUEUED and other.submitted < job.submitted and other.batch != job.batch})
+
+    def eta(self, job):
+        """Seconds until a queued or running job should be finished, or None before any export
+        has finished to estimate from. Runs ahead of it are played out on the job slots at the
+        time per image recent exports took"""
+        with self._lock:
+            per_image = self._seconds_per_image
+            runs = {}
+            for other in sorted(self._jobs.values(), key=lambda other: other.submitted):
+                if other.active:
+                    runs.setdefault(other.batch, other)
+        if per_image is None or not job.active:
+            return None
+        if job.state == RUNNING:
+            return per_image * (job.total - job.done)
+
+        slots = sorted(per_image * (run.total - run.done) for run in runs.values() if run.state == RUNNING)[:self.max_running]
+        slots += [0.0] * (self.max_running - len(slots))
+        heapq.heapify(slots)
+        for run in runs.values():
+            if run.state != QUEUED:
+                continue
+            end = heapq.heappop(slots) + per_image * run.total
+            if run.batch == job.batch:
+                return end
+            heapq.heappush(slots, end)
+        return None
+
+    def _run(self, *jobs):
+        # A single export, or a PDF and a ZIP made together by write_both; the jobs of one run
+        # share its errors, progress and timings
+        metrics = Metrics()
+        started = time.time()
+        for job in jobs:
+            job.state = RUNNING
+            job.started = started
+            job.metrics = metrics
+
+        def on_error(message):
+            for job in jobs:
+                job.errors.append(message)
+
+        def on_progress(done, total):
+            for job in jobs:
+                job._on_progress(done, total)
+
+        first = jobs[0]
+        paths = []
+        try:
+            with ExitStack() as stack:
+                outputs = []
+                for job in jobs:
+                    fd, path = tempfile.mkstemp(dir=self.directory, suffix="." + job.kind)
+                    paths.append(path)
+                    outputs.append(stack.enter_context(os.fdopen(fd, "wb")))
+                if len(jobs) == 1:
+                    counts = [EXPORTERS[first.kind](first._files, first._settings, outputs[0], self.cache, on_error,
+                                                    on_progress, metrics, self.governor)]
+                else:
+                    counts = write_both(first._files, first._settings, *outputs, self.cache, on_error, on_progress, metrics,
+                                        self.governor)
+            for job, path, count in zip(jobs, paths, counts):
+                job.count = count
+                job.path = path
+                job.state = DONE
+            if first.total:
+                per_image = (time.time() - started) / first.total
+                with self._lock:
+                    if self._seconds_per_image is not None:
+                        per_image = self._seconds_per_image + ESTIMATE_SMOOTHING * (per_image - self._seconds_per_image)
+                    self._seconds_per_image = per_image
+        except Exception as e:
+            logger.exception("Export %s failed", "+".join(job.id for job in jobs))
+            for job in jobs:
+                job.errors.append(f"{FAILURE_MESSAGES[job.kind]}: {str(e)}")
+                job.state = FAILED
+            for path in paths:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+        finally:
+            finished = time.time()
+            for job in jobs:
+                # The uploaded bytes are no longer needed once the output exists
+                job._files = None
+                job.finished = finished
+            metrics.finish()
+            metrics.log(job=first.id, export="+".join(job.kind for job in jobs), images=first.total,
+                        output=[job.count for job in jobs] if len(jobs) > 1 else first.count, state=first.state)
+
+    def _purge(self):
+        now = time.time()
+        with self._lock:
+            expired = [job for job in self._jobs.values() if job.finished and now - job.finished > self.keep_seconds]
+            for job in expired:
+                del self._jobs[job.id]
+        for job in expired:
+            if job.path:
+                try:
+                    os.remove(job.path)
+                except OSError:
+                    pass
@@ -0,0 +1,174 @@
+from collections import namedtuple
+import numpy as np
+
+A4_WIDTH, A4_HEIGHT = int(8.27 * 300), int(11.69 * 300)
+TOP_MARGIN_FIRST_PAGE, TOP_MARGIN_SUBSEQUENT_PAGES = 125, 110
+BOTTOM_MARGIN = 105
+GAP_BETWEEN_IMAGES = 20
+OVERLAP_PIXELS = 25
+SIDE_MARGIN = 50
+
+# "greedy" fills every page to the bottom and splits whatever does not fit; "fit" keeps short
+# questions whole, splits long ones on blank rows and picks the plan with the fewest pages
+PACKING_MODES = ("greedy", "fit")
+# In "fit" packing, images up to this tall (half a page) are moved to the next page instead of split
+KEEP_WHOLE_HEIGHT = (A4_HEIGHT - TOP_MARGIN_SUBSEQUENT_PAGES - BOTTOM_MARGIN) // 2
+# Nor is a split image started in less room than this
+MIN_SLICE_HEIGHT = 200
+# How far above the end of a page "greedy" packing looks for a blank row to split an image on
+MAX_CUT_SHIFT = 150
+
+# One horizontal band of a scaled image placed on a page. Rows top:bottom of image `item`
+# go to (x, y); strip_width is the blanked left strip, or None; `first` marks where the
+# question number is drawn.
+Slice = namedtuple("Slice", "item top bottom x y width strip_width first")
+
+
+def target_width(alignment):
+    """Width every image is scaled to for the given alignment"""
+    if alignment == "Center":
+        return A4_WIDTH * 0.9
+    return (A4_WIDTH - SIDE_MARGIN) * 0.9
+
+
+def scaled_dimensions(width, height, alignment):
+    scale = target_width(alignment) / width
+    return int(width * scale), int(height * scale)
+
+
+def x_position(width, alignment):
+    if alignment == "Center":
+        return (A4_WIDTH - width) // 2
+    elif alignment == "Left":
+        return SIDE_MARGIN
+    return A4_WIDTH - width - SIDE_MARGIN
+
+
+def plan_pages(sizes, strip_fractions, alignment, content_top, packing="greedy", blanks=None):
+    """Lay out scaled image sizes in order, splitting an image across pages when it does not
+    fit: on the nearest blank row above the end of the page, or where the page ends with a small
+    overlap when there is none. blanks holds for each image its blank rows (see whitespace_cut)
+    or None. "fit" packing never takes more pages than "greedy". Returns a list of pages, each a
+    list of Slices."""
+    blanks = blanks or [None] * len(sizes)
+    if packing == "fit":
+        pages = plan_pages_fit(sizes, strip_fractions, alignment, content_top, blanks)
+        # Weighing the choices image by image can still miss the greedy plan by a few rows
+        greedy = plan_pages(sizes, strip_fractions, alignment, content_top, "greedy", blanks)
+        return pages if len(pages) <= len(greedy) else greedy
+
+    pages = [[]]
+    y = content_top
+    for item, ((width, height), fraction, blank) in enumerate(zip(sizes, strip_fractions, blanks)):
+        strip_width = int(width * fraction) if fraction is not None else None
+        top = 0
+        first = True
+        while True:
+            remaining = A4_HEIGHT - y - BOTTOM_MARGIN
+            if remaining <= 0 and pages[-1]:
+                pages.append([])
+                y = TOP_MARGIN_SUBSEQUENT_PAGES
+                continue
+            if height - top <= remaining:
+                bottom = next_top = height
+            else:
+                bottom = next_top = whitespace_cut(blank, height, max(top + 1, top + remaining - MAX_CUT_SHIFT), top + remaining)
+                if bottom is None:
+                    bottom = min(height, top + remaining + OVERLAP_PIXELS)
+                    next_top = top + remaining
+            pages[-1].append(Slice(item, top, bottom, x_position(width, alignment), y, width, strip_width, first))
+            first = False
+            y += bottom - top + GAP_BETWEEN_IMAGES
+            if bottom >= height:
+                break
+            top = next_top
+            pages.append([])
+            y = TOP_MARGIN_SUBSEQUENT_PAGES
+    return pages
+
+
+def whitespace_cut(blank, height, low, high):
+    """Row to split an image height rows tall at: the middle of the lowest blank band between
+    rows low and high, or None if there is none. blank marks the blank rows of the image
+    measured at any resolution."""
+    if blank is None or high <= low:
+        return None
+    rows = len(blank)
+    first, last = low * rows // height, min(rows, high * rows // height)
+    candidates = np.flatnonzero(blank[first:last])
+    if not len(candidates):
+        return None
+    end = first + int(candidates[-1])
+    start = end
+    while start > first and blank[start - 1]:
+        start -= 1
+    return max(low, min(high, (start + end + 1) * height // (2 * rows)))
+
+
+def plan_pages_fit(sizes, strip_fractions, alignment, content_top, blanks):
+    """Lay out images in order on the fewest pages, and with that on the fewest splits. An image
+    that does not fit the room left is moved to the next page, split at a blank row when it is
+    taller than KEEP_WHOLE_HEIGHT, or split as "greedy" packing would; every combination of those
+    choices is weighed."""
+    bottom_limit = A4_HEIGHT - BOTTOM_MARGIN
+
+    def place(item, page, y, top, splits, trail, greedy=False):
+        # Put rows top: of the image from (page, y) on, splitting it where it has to be; greedy
+        # splits the way "greedy" packing does, in any room and close to where the page ends
+        (width, height), fraction, blank = sizes[item], strip_fractions[item], blanks[item]
+        strip_width = int(width * fraction) if fraction is not None else None
+        x = x_position(width, alignment)
+        first = True
+        while True:
+            remaining = bottom_limit - y
+            if height - top <= remaining:
+                trail = ((page, Slice(item, top, height, x, y, width, strip_width, first)), trail)
+                return page, y + height - top + GAP_BETWEEN_IMAGES, splits, trail
+            if remaining > 0 if greedy else remaining >= MIN_SLICE_HEIGHT:
+                low = max(top + 1, top + remaining - MAX_CUT_SHIFT) if greedy else top + MIN_SLICE_HEIGHT
+                bottom = next_top = whitespace_cut(blank, height, low, top + remaining)
+                # No blank row in reach: cut where the page ends and repeat a little on the next.
+                # Cutting through the content counts as two splits, so a blank row is preferred
+                through = bottom is None
+                if through:
+                    bottom = min(height, top + remaining + OVERLAP_PIXELS)
+                    next_top = top + remaining
+                trail = ((page, Slice(item, top, bottom, x, y, width, strip_width, first)), trail)
+                if bottom >= height:
+                    # The overlap reached the end of the image
+                    return page, y + bottom - top + GAP_BETWEEN_IMAGES, splits, trail
+                splits += 2 if through else 1
+                first = False
+                top = next_top
+            page, y = page + 1, TOP_MARGIN_SUBSEQUENT_PAGES
+
+    # Each state is (last page, y on it, splits so far, slices placed so far as a linked list)
+    states = [(0, content_top, 0, None)]
+    for item, (_, height) in enumerate(sizes):
+        candidates = []
+        for page, y, splits, trail in states:
+            page_top = content_top if page == 0 else TOP_MARGIN_SUBSEQUENT_PAGES
+            # Splitting the way "greedy" packing would, when that saves a page
+            candidates.append(place(item, page, y, 0, splits, trail, greedy=True))
+            if height <= bottom_limit - y or y == page_top:
+                candidates.append(place(item, page, y, 0, splits, trail))
+                continue
+            if height > KEEP_WHOLE_HEIGHT:
+                candidates.append(place(item, page, y, 0, splits, trail))
+            candidates.append(place(item, page + 1, TOP_MARGIN_SUBSEQUENT_PAGES, 0, splits, trail))
+        # A state is only worth keeping if no state on as few pages, and as high up, has fewer splits
+        candidates.sort(key=lambda state: (state[0], state[1], state[2]))
+        states = []
+        for state in candidates:
+            if not states or state[2] < states[-1][2]:
+                states.append(state)
+
+    page_count, _, _, trail = min(states, key=lambda state: (state[0], state[2], state[1]))
+    pages = [[] for _ in range(page_count + 1)]
+    placed = []
+    while trail is not None:
+        placed.append(trail[0])
+        trail = trail[1]
+    for page, part in reversed(placed):
+        pages[page].append(part)
+    return pages
@@ -0,0 +1,109 @@
+import os, sys, json, time, logging, threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+logger = logging.getLogger(__name__)
+
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+def current_rss_mb():
+    """Resident memory of this process right now, where the platform exposes it"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE / (1024 * 1024)
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def peak_rss_mb():
+    """High-water mark of resident memory for this process"""
+    # ru_maxrss survives fork and exec, so a fresh process would report the parent's peak;
+    # Linux's VmHWM starts over with each program
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+class Metrics:
+    """Per-stage timings for one export: how long each stage took for each image or page,
+    how many pixels it handled and how much memory the process held afterwards"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.records = []
+        self.started = time.time()
+        self.finished = None
+
+    @contextmanager
+    def stage(self, name, item=None, pixels=0):
+        """Time the body as one run of stage name for item (an image name or page label).
+        Yields the record, so the body can fill in "pixels" once it knows them"""
+        record = {"stage": name, "item": item, "pixels": pixels}
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            self.add(name, item, time.perf_counter() - start, record["pixels"])
+
+    def add(self, name, item, seconds, pixels=0):
+        """Record a stage that was timed by the caller"""
+        record = {"stage": name, "item": item, "pixels": int(pixels), "seconds": seconds, "rss_mb": current_rss_mb()}
+        with self._lock:
+            self.records.append(record)
+
+    def finish(self):
+        self.finished = time.time()
+
+    def summary(self):
+        """Totals per stage, in the order the stages first ran"""
+        stages = OrderedDict()
+        with self._lock:
+            records = list(self.records)
+        for record in records:
+            total = stages.setdefault(record["stage"], {"stage": record["stage"], "count": 0, "seconds": 0.0,
+                                                        "megapixels": 0.0, "max_rss_mb": None})
+            total["count"] += 1
+            total["seconds"] += record["seconds"]
+            total["megapixels"] += record["pixels"] / 1e6
+            if record["rss_mb"] is not None:
+                total["max_rss_mb"] = max(total["max_rss_mb"] or 0.0, record["rss_mb"])
+        return list(stages.values())
+
+    def log(self, **context):
+        """Write one JSON line per stage and one for the whole export, tagged with context"""
+        elapsed = (self.finished or time.time()) - self.started
+        for total in self.summary():
+            logger.info(json.dumps(dict(context, event="stage", **{
+                key: round(value, 4) if isinstance(value, float) else value for key, value in total.items()})))
+        peak = peak_rss_mb()
+        logger.info(json.dumps(dict(context, event="export", seconds=round(elapsed, 4),
+                                    peak_rss_mb=round(peak, 1) if peak is not None else None)))
+
+
+class NoMetrics(Metrics):
+    """Stand-in used when nobody asked for measurements"""
+
+    @contextmanager
+    def stage(self, name, item=None, pixels=0):
+        yield {}
+
+    def add(self, name, item, seconds, pixels=0):
+        pass
+
+
+NO_METRICS = NoMetrics()
@@ -0,0 +1,109 @@
+"""Question numbers and strips for a batch of images.
+
+The ranges typed into the settings ("1-5, 8", "6-10:41") are kept as intervals instead of
+being expanded into one entry per number, and a whole batch is numbered in one pass of
+array operations."""
+import numpy as np
+
+
+def parse_ranges(text):
+    """Inclusive (start, end) intervals from text like "1-5, 8" """
+    intervals = []
+    if not text:
+        return intervals
+    for part in text.split(','):
+        part = part.strip()
+        if '-' in part:
+            start, end = map(int, part.split('-'))
+            if start <= end:
+                intervals.append((start, end))
+        elif part:
+            number = int(part)
+            intervals.append((number, number))
+    return intervals
+
+
+def parse_numbering(text):
+    """Inclusive (start, end, first number) intervals from text like "1-5:1, 6-10:41".
+    Parts whose number is not an integer are ignored"""
+    intervals = []
+    if not text:
+        return intervals
+    for part in text.split(','):
+        part = part.strip()
+        if ':' in part:
+            image_range, first_number = part.split(':')
+            try:
+                first_number = int(first_number)
+            except ValueError:
+                continue
+            if '-' in image_range:
+                start, end = map(int, image_range.split('-'))
+            else:
+                start = end = int(image_range)
+            if start <= end:
+                intervals.append((start, end, first_number))
+    return intervals
+
+
+class IntervalMap:
+    """Values attached to inclusive integer intervals, found by binary search. Each interval
+    is (start, end, value, step): the value at start, rising by step per number after it.
+    Where intervals overlap the one given last wins."""
+
+    def __init__(self, intervals):
+        intervals = list(intervals)
+        bounds = sorted({bound for start, end, _, _ in intervals for bound in (start, end + 1)})
+        starts, ends, values, steps = [], [], [], []
+        # Cut the number line at every interval edge; each piece then lies wholly inside or
+        # outside every interval, so the last interval covering its start covers all of it
+        for low, high in zip(bounds, bounds[1:]):
+            for start, end, value, step in reversed(intervals):
+                if start <= low and high - 1 <= end:
+                    starts.append(low)
+                    ends.append(high)
+                    values.append(value + step * (low - start))
+                    steps.append(step)
+                    break
+        self._starts = np.array(starts, np.int64)
+        self._ends = np.array(ends, np.int64)
+        self._values = np.array(values, np.float64)
+        self._steps = np.array(steps, np.float64)
+
+    def lookup(self, numbers):
+        """Value for each of numbers, NaN where no interval covers it"""
+        numbers = np.asarray(numbers, np.int64)
+        result = np.full(numbers.shape, np.nan)
+        if not len(self._starts):
+            return result
+        index = np.searchsorted(self._starts, numbers, side='right') - 1
+        inside = index >= 0
+        index = np.maximum(index, 0)
+        inside &= numbers < self._ends[index]
+        index, covered = index[inside], numbers[inside]
+        result[inside] = self._values[index] + self._steps[index] * (covered - self._starts[index])
+        return result
+
+
+def strip_map(settings):
+    """Strip fraction by question number; later ranges win"""
+    return IntervalMap((start, end, ratio, 0) for qnos_str, ratio in settings.strips if qnos_str
+                       for start, end in parse_ranges(qnos_str))
+
+
+def plan_numbering(count, settings):
+    """Number count images in order. Returns (index, question number, strip fraction or None)
+    for every image that gets a number; skipped images are left out"""
+    positions = np.arange(1, count + 1)
+    custom = IntervalMap((start, end, first, 1) for start, end, first in parse_numbering(settings.multi_numbering)).lookup(positions)
+    skipped = ~np.isnan(IntervalMap((start, end, 1, 0) for start, end in parse_ranges(settings.skip_numbering)).lookup(positions))
+
+    # Images without a custom number take the next number in sequence unless they are skipped
+    has_custom = ~np.isnan(custom)
+    counted = ~has_custom & ~skipped
+    numbers = np.where(has_custom, custom, np.cumsum(counted)).astype(np.int64)
+    numbered = has_custom | counted
+    fractions = strip_map(settings).lookup(numbers)
+
+    return [(int(index), int(numbers[index]), None if np.isnan(fractions[index]) else float(fractions[index]))
+            for index in np.flatnonzero(numbered)]
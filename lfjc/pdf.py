@@ -0,0 +1,211 @@
+import io, zlib
+from datetime import datetime, timezone
+from PIL import Image, features
+
+
+class Name(str):
+    """A PDF name object, written as /Name"""
+
+
+class Ref(int):
+    """An indirect reference to object number n, written as n 0 R"""
+
+
+def pdf_value(value):
+    if isinstance(value, Name):
+        return "/" + value
+    if isinstance(value, Ref):
+        return "%d 0 R" % value
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, int):
+        return str(value)
+    if isinstance(value, float):
+        return ("%.4f" % value).rstrip("0").rstrip(".")
+    if isinstance(value, bytes):
+        escaped = value.replace(b"\\", b"\\\\").replace(b"(", b"\\(").replace(b")", b"\\)")
+        return "(" + escaped.decode("latin-1") + ")"
+    if isinstance(value, dict):
+        return "<< " + " ".join("/%s %s" % (key, pdf_value(item)) for key, item in value.items()) + " >>"
+    if isinstance(value, (list, tuple)):
+        return "[ " + " ".join(pdf_value(item) for item in value) + " ]"
+    return str(value)
+
+
+def encode_ccitt_g4(image):
+    """CCITT Group 4 data for a mode '1' image, taken from a single-strip TIFF written by libtiff"""
+    buffer = io.BytesIO()
+    image.save(buffer, "TIFF", compression="group4", tiffinfo={278: image.height})
+    buffer.seek(0)
+    with Image.open(buffer) as tiff:
+        offsets, counts = tiff.tag_v2[273], tiff.tag_v2[279]
+    data = buffer.getbuffer()
+    return b"".join(bytes(data[offset:offset + count]) for offset, count in zip(offsets, counts))
+
+
+def jpeg_image(image, quality=75):
+    """Image XObject dictionary and DCT-encoded data for an RGB or greyscale PIL image"""
+    if image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+    buffer = io.BytesIO()
+    image.save(buffer, "JPEG", quality=quality)
+    return {
+        "Type": Name("XObject"),
+        "Subtype": Name("Image"),
+        "Width": image.width,
+        "Height": image.height,
+        "ColorSpace": Name("DeviceRGB" if image.mode == "RGB" else "DeviceGray"),
+        "BitsPerComponent": 8,
+        "Filter": Name("DCTDecode"),
+    }, buffer.getvalue()
+
+
+def bilevel_image(image, stencil=False):
+    """Image XObject dictionary and data for a 1-bit image, CCITT G4 compressed when libtiff is
+    available and Flate otherwise. A stencil mask paints its black pixels in the current fill
+    colour and leaves the rest untouched"""
+    if image.mode != "1":
+        image = image.convert("1", dither=Image.Dither.NONE)
+    dictionary = {
+        "Type": Name("XObject"),
+        "Subtype": Name("Image"),
+        "Width": image.width,
+        "Height": image.height,
+        "BitsPerComponent": 1,
+    }
+    if stencil:
+        dictionary["ImageMask"] = True
+    else:
+        dictionary["ColorSpace"] = Name("DeviceGray")
+
+    if features.check("libtiff"):
+        # libtiff stores mode '1' as min-is-black, so white pixels come out as fax "black" bits
+        dictionary["Filter"] = Name("CCITTFaxDecode")
+        dictionary["DecodeParms"] = {"K": -1, "Columns": image.width, "Rows": image.height, "BlackIs1": True}
+        data = encode_ccitt_g4(image)
+    else:
+        dictionary["Filter"] = Name("FlateDecode")
+        data = zlib.compress(image.tobytes(), 6)
+    return dictionary, data
+
+
+class PdfWriter:
+    """Incremental PDF writer: objects go to the output as soon as they are added,
+    so only the cross-reference table is kept in memory"""
+
+    CATALOG, PAGES = 1, 2
+
+    def __init__(self, fileobj, resolution=72.0):
+        self.f = fileobj
+        self.resolution = resolution
+        self._start = fileobj.tell()
+        self._offsets = {}
+        self._next_number = 3
+        self._page_refs = []
+        self._fonts = []
+        self._closed = False
+        self._write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+
+    @property
+    def page_count(self):
+        return len(self._page_refs)
+
+    def _write(self, data):
+        self.f.write(data)
+
+    def reserve(self):
+        number = self._next_number
+        self._next_number += 1
+        return Ref(number)
+
+    def add_object(self, dictionary, stream=None, ref=None):
+        ref = self.reserve() if ref is None else ref
+        self._offsets[int(ref)] = self.f.tell() - self._start
+        if stream is not None:
+            dictionary = dict(dictionary, Length=len(stream))
+        self._write(b"%d 0 obj\n" % ref)
+        self._write(pdf_value(dictionary).encode("latin-1"))
+        if stream is not None:
+            self._write(b"\nstream\n")
+            self._write(stream)
+            self._write(b"\nendstream")
+        self._write(b"\nendobj\n")
+        return ref
+
+    def image_ops(self, name, x, y, width, height, page_height, gray=None):
+        """Content stream operators that draw XObject name over the pixel box (x, y, width, height),
+        measured from the top-left corner of a page page_height pixels tall"""
+        ops = "q "
+        if gray is not None:
+            ops += "%s g " % pdf_value(float(gray))
+        ops += "%s 0 0 %s %s %s cm /%s Do Q\n" % (
+            pdf_value(self.to_points(width)), pdf_value(self.to_points(height)),
+            pdf_value(self.to_points(x)), pdf_value(self.to_points(page_height - y - height)), name)
+        return ops.encode("latin-1")
+
+    def add_font(self, font):
+        """Register a font for text operators; it is written, subset to the glyphs used, on close"""
+        ref = self.reserve()
+        self._fonts.append((font, ref))
+        return ref
+
+    def text_ops(self, name, font, text, size, x, y, page_height, gray=0.0):
+        """Content stream operators that draw text in font resource name at size pixels,
+        with the top-left of its line box at (x, y) like ImageDraw.text"""
+        baseline = y + font.text_ascent(size)
+        ops = "BT %s g /%s %s Tf %s %s Td " % (
+            pdf_value(float(gray)), name, pdf_value(self.to_points(size)),
+            pdf_value(self.to_points(x)), pdf_value(self.to_points(page_height - baseline)))
+        return ops.encode("latin-1") + font.show(text) + b" ET\n"
+
+    def add_form(self, width, height, content, resources):
+        """Write a form XObject covering width x height pixels that pages can draw any number of times"""
+        return self.add_object({
+            "Type": Name("XObject"),
+            "Subtype": Name("Form"),
+            "BBox": [0, 0, self.to_points(width), self.to_points(height)],
+            "Resources": resources,
+        }, content)
+
+    def add_page(self, width, height, content, resources):
+        """Write a page of width x height pixels whose content stream is already in PDF units"""
+        content_ref = self.add_object({}, content)
+        page_ref = self.add_object({
+            "Type": Name("Page"),
+            "Parent": Ref(self.PAGES),
+            "MediaBox": [0, 0, self.to_points(width), self.to_points(height)],
+            "Resources": resources,
+            "Contents": content_ref,
+        })
+        self._page_refs.append(page_ref)
+        return page_ref
+
+    def to_points(self, pixels):
+        return float(pixels * 72.0 / self.resolution)
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        for font, ref in self._fonts:
+            font.write(self, ref)
+        self.add_object({
+            "Type": Name("Pages"),
+            "Kids": list(self._page_refs),
+            "Count": len(self._page_refs),
+        }, ref=Ref(self.PAGES))
+        self.add_object({"Type": Name("Catalog"), "Pages": Ref(self.PAGES)}, ref=Ref(self.CATALOG))
+        created = datetime.now(timezone.utc).strftime("D:%Y%m%d%H%M%SZ").encode("latin-1")
+        info_ref = self.add_object({"CreationDate": created, "ModDate": created})
+
+        xref_offset = self.f.tell() - self._start
+        count = self._next_number
+        lines = [b"xref\n0 %d\n" % count, b"0000000000 65535 f \n"]
+        for number in range(1, count):
+            if number in self._offsets:
+                lines.append(b"%010d 00000 n \n" % self._offsets[number])
+            else:
+                lines.append(b"0000000000 65535 f \n")
+        self._write(b"".join(lines))
+        trailer = {"Size": count, "Root": Ref(self.CATALOG), "Info": info_ref}
+        self._write(b"trailer\n" + pdf_value(trailer).encode("latin-1") + b"\nstartxref\n%d\n%%%%EOF\n" % xref_offset)
@@ -0,0 +1,93 @@
+from contextlib import nullcontext
+from PIL import Image, ImageDraw
+import numpy as np
+
+from lfjc.cache import content_key
+from lfjc.core import (QUESTION_SIZE, PAGE_NUMBER_SIZE, decode_image, decode_pixels, read_file_bytes, file_image_size,
+                       plan_pdf, run_ordered, find_font_path, load_font_with_size, report_error)
+from lfjc.fonts import load_pdf_font
+from lfjc.layout import A4_WIDTH, A4_HEIGHT, target_width
+
+PREVIEW_PAGE_WIDTH = 400
+
+
+def load_thumbnail(file_info, width, cache=None, region=None, governor=None):
+    """Greyscale copy of an image, or of the region of it that is kept, scaled to width pixels
+    and cached by content. A governor admits the decode like any other"""
+    file_bytes = read_file_bytes(file_info)
+
+    def make():
+        # The JPEG decoder skips straight to a reduced scale, so this costs a fraction of a full decode
+        original_width, original_height = file_image_size(file_info, region)
+        height = max(1, round(original_height * width / original_width))
+        with governor.admit(decode_pixels(file_bytes, (width, height), region)) if governor is not None else nullcontext():
+            return np.asarray(decode_image(file_bytes, (width, height), region).convert('L'))
+
+    if cache is None:
+        return Image.fromarray(make())
+    key = content_key(file_bytes, "thumbnail", width, *(() if region is None else (region,)))
+    return Image.fromarray(cache.get_or_compute(key, make))
+
+
+def render_preview(files, settings, cache=None, page_width=PREVIEW_PAGE_WIDTH, on_error=report_error, governor=None):
+    """Draw the page plan at thumbnail size: every page as an 'L' image page_width pixels wide,
+    with the blanked strips, question numbers and header where the PDF will have them. With a
+    governor the decoding runs on its pool, under its limits"""
+    scale = page_width / A4_WIDTH
+    pdf_font = load_pdf_font(find_font_path())
+    header, jobs, pages = plan_pdf(files, settings, pdf_font, on_error, cache, governor)
+
+    thumb_width = max(1, round(target_width(settings.alignment) * scale))
+    thumbnails = [result for _, result, _ in run_ordered(lambda job: load_thumbnail(job[0], thumb_width, cache, job[3], governor),
+                                                         jobs, settings.workers, governor)]
+
+    def px(value):
+        return int(round(value * scale))
+
+    fonts = {}
+
+    def draw_text(draw, text, size, x, y):
+        font = fonts.get(size) or fonts.setdefault(size, load_font_with_size(max(6, px(size))))
+        draw.text((px(x), px(y)), text, fill=0, font=font)
+
+    arrays = {}
+
+    def pixels(part):
+        # The thumbnail as an array exactly as wide as the image is drawn on the page, made once per image
+        if part.item not in arrays:
+            thumbnail = thumbnails[part.item]
+            if thumbnail.width != px(part.width):
+                thumbnail = thumbnail.resize((px(part.width), max(1, round(thumbnail.height * px(part.width) / thumbnail.width))))
+            arrays[part.item] = np.asarray(thumbnail)
+        return arrays[part.item]
+
+    rendered = []
+    for page_number, page_slices in enumerate(pages, start=1):
+        page = Image.new('L', (page_width, px(A4_HEIGHT)), 255)
+        draw = ImageDraw.Draw(page)
+        if page_number == 1:
+            for text, size, x, y in header:
+                draw_text(draw, text, size, x, y)
+
+        for part in page_slices:
+            if thumbnails[part.item] is not None:
+                band = pixels(part)[px(part.top):max(px(part.top) + 1, px(part.bottom))]
+                if part.strip_width is not None:
+                    band = band.copy()
+                    band[:, :px(part.x + part.strip_width) - px(part.x) + 1] = 255
+                page.paste(Image.fromarray(band), (px(part.x), px(part.y)))
+            else:
+                draw.rectangle((px(part.x), px(part.y), px(part.x + part.width), px(part.y + part.bottom - part.top)), outline=128)
+
+            if part.first:
+                label = f"{jobs[part.item][1]}."
+                if part.strip_width is not None:
+                    text_x = part.strip_width - int(pdf_font.width(label, QUESTION_SIZE)) - 10
+                else:
+                    text_x = 10
+                draw_text(draw, label, QUESTION_SIZE, part.x + text_x, part.y + 10)
+
+        if page_number > 1:
+            draw_text(draw, str(page_number), PAGE_NUMBER_SIZE, A4_WIDTH // 2, A4_HEIGHT - 50)
+        rendered.append(page)
+    return rendered
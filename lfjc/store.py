@@ -0,0 +1,76 @@
+import os, time, hashlib, tempfile, threading
+
+from lfjc.core import read_image_size
+
+COLLECT_INTERVAL = 600
+
+
+class UploadStore:
+    """Content-addressed store of uploaded images on disk, shared by every session.
+    Sessions keep only the hash, name and size of each image; identical uploads are stored
+    once, and blobs no session has touched for max_idle seconds are deleted."""
+
+    def __init__(self, directory, max_idle):
+        self.directory = directory
+        self.max_idle = max_idle
+        self._lock = threading.Lock()
+        self._last_collect = 0.0
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, digest):
+        return os.path.join(self.directory, digest[:2], digest)
+
+    def add(self, name, data):
+        """Store data and return the queue entry for it; raises if it is not a readable image"""
+        width, height = read_image_size(data)
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.path(digest)
+        if os.path.exists(path):
+            os.utime(path)
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    f.write(data)
+                os.replace(tmp_path, path)
+            except BaseException:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                raise
+        return {'name': name, 'hash': digest, 'path': path, 'width': width, 'height': height}
+
+    def touch(self, entries):
+        """Mark the blobs behind entries as in use by a live session; returns the entries
+        whose blobs are still there"""
+        present = []
+        for entry in entries:
+            try:
+                os.utime(entry['path'])
+            except OSError:
+                continue
+            present.append(entry)
+        return present
+
+    def collect(self):
+        """Delete blobs idle for longer than max_idle; does nothing if it ran recently"""
+        now = time.time()
+        with self._lock:
+            if now - self._last_collect < min(COLLECT_INTERVAL, self.max_idle):
+                return 0
+            self._last_collect = now
+        removed = 0
+        cutoff = now - self.max_idle
+        for shard in os.listdir(self.directory):
+            shard_path = os.path.join(self.directory, shard)
+            if not os.path.isdir(shard_path):
+                continue
+            for name in os.listdir(shard_path):
+                path = os.path.join(shard_path, name)
+                try:
+                    if os.stat(path).st_mtime < cutoff:
+                        os.remove(path)
+                        removed += 1
+                except OSError:
+                    pass
+        return removed
@@ -0,0 +1,56 @@
+import io
+import zipfile
+
+from PIL import Image
+
+from lfjc.core import Settings, create_zip, create_both, plan_pdf, find_font_path, decode_pixels
+from lfjc.document import Region
+from lfjc.fonts import load_pdf_font
+
+
+def sheet(name, width=120, height=90):
+    # A small blank page with a dark band, enough for enhancement to work on
+    img = Image.new('RGB', (width, height), 'white')
+    img.paste((30, 30, 30), (10, height // 2, width - 10, height // 2 + 6))
+    buffer = io.BytesIO()
+    img.save(buffer, 'PNG')
+    return {'name': name, 'bytes': buffer.getvalue()}
+
+
+def zip_names(data):
+    return sorted(zipfile.ZipFile(io.BytesIO(data)).namelist())
+
+
+def test_zip_leaves_out_an_image_numbered_zero():
+    files = [sheet(f"q{n}.png") for n in (1, 2, 3)]
+    data, count = create_zip(files, Settings(multi_numbering="1:0", enhancement_profile="fast", workers=1))
+    assert zip_names(data) == ['Q001.png', 'Q002.png']
+    assert count == 2
+
+
+def test_pdf_and_zip_number_files_in_natural_order_whatever_order_they_come_in():
+    # Widths tell the sheets apart in the archive
+    files = [sheet(name, width=width) for name, width in (("q10.png", 150), ("q2.png", 130), ("q1.png", 110))]
+    settings = Settings(exam_type="A", exam_date="1", enhancement_profile="fast", workers=1)
+    _, jobs, _ = plan_pdf(files, settings, load_pdf_font(find_font_path()))
+    assert [(file_info['name'], number) for file_info, number, _, _ in jobs] == [("q1.png", 1), ("q2.png", 2), ("q10.png", 3)]
+
+    _, data, _ = create_both(files, settings)
+    archive = zipfile.ZipFile(io.BytesIO(data))
+    widths = {name: Image.open(io.BytesIO(archive.read(name))).width for name in archive.namelist()}
+    assert widths == {'Q001.png': 110, 'Q002.png': 130, 'Q003.png': 150}
+
+
+def test_decodes_are_admitted_at_the_whole_photo_unless_a_jpeg_drafts_down():
+    photos = {}
+    for fmt in ('JPEG', 'PNG'):
+        buffer = io.BytesIO()
+        Image.new('RGB', (4000, 3000), 'white').save(buffer, fmt)
+        photos[fmt] = buffer.getvalue()
+    region = Region(None, 2000, 900)
+    assert decode_pixels(photos['PNG'], (500, 375)) == 4000 * 3000
+    assert decode_pixels(photos['PNG'], (2000, 900), region) == 4000 * 3000
+    assert decode_pixels(photos['JPEG'], (500, 375)) == 500 * 375
+    assert decode_pixels(photos['JPEG'], None, region) == 4000 * 3000
+    # Scaling up holds the larger result
+    assert decode_pixels(photos['JPEG'], (8000, 6000)) == 8000 * 6000
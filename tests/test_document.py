@@ -0,0 +1,25 @@
+import numpy as np
+import pytest
+
+from lfjc.document import Region, pack_region, unpack_region
+
+PROFILE = np.array([0, 3, 640])
+
+
+@pytest.mark.parametrize("region", [
+    None,
+    Region(None, 1080, 1920),
+    Region(None, 1080, 70000),
+    Region(((0, 0), (70000, 1), (70001, 90000), (5, 123456)), 99999, (1 << 32) - 1),
+])
+def test_region_and_profile_survive_packing(region):
+    packed = pack_region(region, PROFILE)
+    assert packed.dtype == np.uint16 and packed.ndim == 2
+    unpacked, profile = unpack_region(packed)
+    assert unpacked == region
+    assert list(profile) == list(PROFILE)
+
+
+def test_packing_refuses_fields_past_32_bits():
+    with pytest.raises(ValueError):
+        pack_region(Region(None, 1080, 1 << 32), PROFILE)
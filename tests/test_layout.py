@@ -0,0 +1,85 @@
+import random
+
+import numpy as np
+import pytest
+
+from lfjc.layout import (A4_HEIGHT, BOTTOM_MARGIN, OVERLAP_PIXELS, TOP_MARGIN_SUBSEQUENT_PAGES,
+                         plan_pages, whitespace_cut)
+
+CONTENT_TOP = 300
+
+
+def banded(height, every, band=20, rows=None):
+    # Blank rows in a band every `every` rows, measured at `rows` rows (default: full size)
+    rows = rows or height
+    blank = np.zeros(rows, bool)
+    for start in range(every, height, every):
+        blank[start * rows // height:(start + band) * rows // height] = True
+    return blank
+
+
+def plan(sizes, packing, blanks=None):
+    return plan_pages(sizes, [None] * len(sizes), "Center", CONTENT_TOP, packing, blanks)
+
+
+def slices_of(pages, item):
+    return [part for page in pages for part in page if part.item == item]
+
+
+def test_whitespace_cut_takes_the_middle_of_the_lowest_blank_band():
+    blank = np.zeros(1000, bool)
+    blank[200:220] = blank[600:640] = True
+    assert whitespace_cut(blank, 1000, 0, 900) == 620
+    assert whitespace_cut(blank, 1000, 0, 500) == 210
+    assert whitespace_cut(blank, 1000, 650, 900) is None
+    assert whitespace_cut(None, 1000, 0, 900) is None
+    # A mask measured at a tenth of the size still cuts at full-size rows
+    assert whitespace_cut(blank[::10], 10000, 0, 9000) == 6200
+
+
+def test_fit_moves_a_short_image_whole_where_greedy_splits_it():
+    sizes = [(2000, 2500), (2000, 1000)]
+    assert len(slices_of(plan(sizes, "greedy"), 1)) == 2
+    pages = plan(sizes, "fit")
+    assert [[part.item for part in page] for page in pages] == [[0], [1]]
+    [moved] = slices_of(pages, 1)
+    assert (moved.top, moved.bottom, moved.y) == (0, 1000, TOP_MARGIN_SUBSEQUENT_PAGES)
+
+
+@pytest.mark.parametrize("packing, every", [("greedy", 100), ("fit", 100), ("fit", 500)])
+@pytest.mark.parametrize("rows", [None, 800])
+def test_tall_images_split_only_on_blank_rows_without_overlap(packing, every, rows):
+    sizes = [(2000, 1200), (2000, 8000), (2000, 900)]
+    blank = banded(8000, every, rows=rows)
+    parts = slices_of(plan(sizes, packing, [None, blank, None]), 1)
+    assert len(parts) > 1
+    assert parts[0].top == 0 and parts[-1].bottom == 8000
+    for part, following in zip(parts, parts[1:]):
+        assert blank[part.bottom * len(blank) // 8000]
+        assert following.top == part.bottom
+
+
+def test_without_blank_rows_a_split_fills_the_page_and_repeats_a_little():
+    parts = slices_of(plan([(2000, 8000)], "greedy"), 0)
+    for part, following in zip(parts, parts[1:]):
+        assert part.y + part.bottom - part.top == A4_HEIGHT - BOTTOM_MARGIN + OVERLAP_PIXELS
+        assert following.top == part.bottom - OVERLAP_PIXELS
+
+
+def test_fit_never_takes_more_pages_than_greedy():
+    rng = random.Random(23)
+    for _ in range(500):
+        sizes = [(2000, rng.randint(100, 6000)) for _ in range(rng.randint(1, 10))]
+        blanks = []
+        for _, height in sizes:
+            blank = np.zeros(height // 10, bool)
+            for _ in range(rng.randint(0, 8)):
+                start = rng.randrange(len(blank))
+                blank[start:start + rng.randint(1, 10)] = True
+            blanks.append(blank if rng.random() < 0.8 else None)
+        fit = plan(sizes, "fit", blanks)
+        assert len(fit) <= len(plan(sizes, "greedy", blanks)), sizes
+        # Every image is still laid out whole, top to bottom
+        for item, (_, height) in enumerate(sizes):
+            parts = slices_of(fit, item)
+            assert parts[0].top == 0 and parts[-1].bottom == height
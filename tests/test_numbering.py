@@ -0,0 +1,99 @@
+import random
+import math
+
+from lfjc.core import Settings
+from lfjc.numbering import IntervalMap, parse_ranges, parse_numbering, plan_numbering
+
+
+# The dict-based numbering plan_numbering replaced, kept as the reference it must match
+def legacy_ranges(text):
+    numbers = []
+    for part in (text or "").split(','):
+        part = part.strip()
+        if '-' in part:
+            start, end = map(int, part.split('-'))
+            numbers.extend(range(start, end + 1))
+        elif part:
+            numbers.append(int(part))
+    return numbers
+
+
+def legacy_numbering(text):
+    numbering = {}
+    for part in (text or "").split(','):
+        part = part.strip()
+        if ':' in part:
+            image_range, first = part.split(':')
+            try:
+                first = int(first)
+            except ValueError:
+                continue
+            if '-' in image_range:
+                start, end = map(int, image_range.split('-'))
+                for offset, index in enumerate(range(start, end + 1)):
+                    numbering[index] = first + offset
+            else:
+                numbering[int(image_range)] = first
+    return numbering
+
+
+def legacy_plan(count, settings):
+    strips = {}
+    for text, ratio in settings.strips:
+        if text:
+            for number in legacy_ranges(text):
+                strips[number] = ratio
+    numbering = legacy_numbering(settings.multi_numbering)
+    skipped = legacy_ranges(settings.skip_numbering)
+    plan, counter = [], 0
+    for index in range(count):
+        position = index + 1
+        if position in numbering:
+            number = numbering[position]
+        elif position not in skipped:
+            counter += 1
+            number = counter
+        else:
+            continue
+        plan.append((index, number, strips.get(number)))
+    return plan
+
+
+def random_ranges(rng, count, numbered=False):
+    parts = []
+    for _ in range(rng.randint(0, 4)):
+        start = rng.randint(1, count + 2)
+        end = start + rng.randint(-1, 5)
+        part = f"{start}-{end}" if rng.random() < 0.6 else str(start)
+        if numbered:
+            part += f":{rng.choice([rng.randint(0, 60), 'x'])}"
+        parts.append(part)
+    return ", ".join(parts)
+
+
+def test_interval_map_later_intervals_win_and_steps_count_from_their_start():
+    intervals = IntervalMap([(1, 10, 100, 1), (4, 6, 0.5, 0), (20, 20, 7, 0)])
+    values = intervals.lookup([1, 3, 4, 6, 7, 10, 20])
+    assert list(values) == [100, 102, 0.5, 0.5, 106, 109, 7]
+    assert all(math.isnan(value) for value in intervals.lookup([0, 11, 19, 21]))
+
+
+def test_interval_map_without_intervals_covers_nothing():
+    assert all(math.isnan(value) for value in IntervalMap([]).lookup([1, 2, 3]))
+
+
+def test_parsers_drop_reversed_ranges_and_bad_numbers():
+    assert parse_ranges("1-3, 8, 5-4") == [(1, 3), (8, 8)]
+    assert parse_numbering("1-2:5, 3:x, 4:9, 6-5:1") == [(1, 2, 5), (4, 4, 9)]
+
+
+def test_plan_numbering_matches_the_dict_based_numbering():
+    rng = random.Random(20)
+    for _ in range(2000):
+        count = rng.randint(0, 30)
+        settings = Settings(
+            strips=[(random_ranges(rng, count), rng.choice([0.1, 0.25])) for _ in range(rng.randint(0, 3))],
+            multi_numbering=random_ranges(rng, count, numbered=True),
+            skip_numbering=random_ranges(rng, count),
+        )
+        assert plan_numbering(count, settings) == legacy_plan(count, settings), settings